@@ -0,0 +1,69 @@
+"""Time the native Code 128 rasterizer against the python-barcode PNG pipeline.
+
+    python benchmarks/bench_barcode.py --cards 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image
+
+from stocard_barcode import code128_modules, render_code128
+
+
+def render_python_barcode(card_number, size):
+    """What both viewers did before: write a PNG, decode it, LANCZOS resize"""
+    import barcode
+    from barcode.writer import ImageWriter
+
+    buffer = BytesIO()
+    barcode.get('code128', str(card_number), writer=ImageWriter()).write(buffer)
+    buffer.seek(0)
+    return Image.open(buffer).resize(size, Image.Resampling.LANCZOS)
+
+
+def check_pattern(card_number, size):
+    """The rasterized row must read back as python-barcode's module pattern"""
+    import barcode
+
+    expected = barcode.get('code128', str(card_number)).build()[0]
+    row = render_code128(card_number, size).convert("L").crop((0, 0, size[0], 1)).tobytes()
+    bars = row.strip(b"\xff")
+    scale = (len(bars) + 1) // len(expected) or 1
+    modules = "".join("1" if px == 0 else "0" for px in bars[::scale])
+    assert modules == expected == code128_modules(card_number), card_number
+
+
+def per_card_ms(render, numbers, size):
+    start = time.perf_counter()
+    for number in numbers:
+        render(number, size)
+    return (time.perf_counter() - start) / len(numbers) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    # Stay clear of a leading "99", which python-barcode encodes wrongly
+    numbers = [f"{rng.randrange(10**12, 9 * 10**12):013d}" for _ in range(args.cards)]
+    numbers += [f"C{rng.randrange(10**9)}X" for _ in range(args.cards // 10)]
+
+    for size in ((400, 100), (350, 80)):
+        for number in numbers[:50] + numbers[-10:]:
+            check_pattern(number, size)
+        legacy = per_card_ms(render_python_barcode, numbers, size)
+        native = per_card_ms(render_code128, numbers, size)
+        print(f"{size[0]}x{size[1]}: python-barcode {legacy:.3f} ms/card, "
+              f"native {native:.3f} ms/card ({legacy / native:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Measure interpreter start plus import time of each tool module.
+
+    python benchmarks/bench_import.py --repeat 20 --output import_times.json
+
+Every module is imported in a fresh interpreter, the way a batch job's
+short-lived processes pay for it. The fastest of --repeat runs is kept and
+the cost of starting a bare interpreter is reported separately. -X importtime
+then names the heaviest imports each module still pulls in.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULES = [
+    "stocard_loader",
+    "stocard_extractor",
+    "stocard_batch",
+    "stocard_logos",
+    "stocard_snapshot",
+    "stocard_barcode",
+    "stocard_background",
+    "stocard_gui",
+    "stocard_viewer",
+    "stocard_sheets",
+    "stocard_server",
+    "stocard_cards",
+]
+
+
+def run_seconds(code, repeat):
+    """Fastest wall time of `python -c code` over repeat runs, or None if it fails"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def heaviest_imports(module, count):
+    """[(name, cumulative microseconds)] of the slowest direct imports of module"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # The header line
+        # Two spaces of indent per level; level 1 are module's own imports
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            imports.append((name.strip(), int(cumulative)))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="runs per module, the fastest is kept")
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports to list per module")
+    parser.add_argument("--modules", default=",".join(MODULES), help="comma separated module names")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    baseline = run_seconds("pass", args.repeat)
+    print(f"bare interpreter: {baseline * 1000:.1f} ms")
+    results = {"python": sys.version.split()[0], "interpreter_seconds": baseline, "modules": {}}
+    for module in args.modules.split(","):
+        seconds = run_seconds(f"import {module}", args.repeat)
+        if seconds is None:
+            print(f"{module}: import failed (missing dependency or no display?)")
+            results["modules"][module] = {"error": "import failed"}
+            continue
+        heaviest = heaviest_imports(module, args.top)
+        results["modules"][module] = {"seconds": seconds, "import_seconds": seconds - baseline,
+                                      "heaviest": heaviest}
+        listing = ", ".join(f"{name} {us / 1000:.1f}" for name, us in heaviest)
+        print(f"{module}: {seconds * 1000:.1f} ms (+{(seconds - baseline) * 1000:.1f} ms imports; "
+              f"heaviest ms: {listing})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
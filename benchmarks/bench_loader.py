@@ -0,0 +1,65 @@
+"""Compare the original LIKE-scan queries with stocard_loader.load_all.
+
+    python benchmarks/bench_loader.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stocard_loader import load_all
+from synth_db import generate
+
+
+def legacy_load(path):
+    """The queries stocard_extractor.py ran before the loader existed"""
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("SELECT content FROM synced_resources WHERE content LIKE '%distinct_backend_id%'")
+    user_id = json.loads(cur.fetchone()[0])["distinct_backend_id"]
+    cur.execute(f"""
+        SELECT content FROM synced_resources
+        WHERE collection LIKE '/users/{user_id}/loyalty-cards/%' AND deleted = 0
+    """)
+    images = 0
+    for (content,) in cur.fetchall():
+        ref = json.loads(content)["input_provider_reference"]["identifier"]
+        row = conn.execute("""
+            SELECT content, content_type FROM synced_resources
+            WHERE collection LIKE ? AND content_type LIKE 'image/%' AND deleted = 0
+        """, (f"{ref}%",)).fetchone()
+        images += row is not None
+    conn.close()
+    return images
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--providers", type=int, default=50)
+    parser.add_argument("--path", default="bench_sync_db")
+    args = parser.parse_args()
+
+    for with_index in (False, True):
+        generate(args.path, args.rows, args.cards, args.providers, with_index=with_index)
+        legacy = timed(legacy_load, args.path)
+        loader = timed(load_all, args.path)
+        print(f"rows={args.rows} cards={args.cards} providers={args.providers} "
+              f"index={with_index}: "
+              f"legacy {legacy:.3f}s, loader {loader:.3f}s")
+    os.remove(args.path)
+
+
+if __name__ == "__main__":
+    main()
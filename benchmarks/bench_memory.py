@@ -0,0 +1,97 @@
+"""Compare the memory held by cards kept as dicts and in a CardStore.
+
+    python benchmarks/bench_memory.py --cards 100000 --providers 500
+
+Loads the cards of a synthetic sync_db twice, once into a list of dicts
+and once into a CardStore, both as the loader yields them and as the
+viewers keep them in watch mode (number, label, provider ID, logo path,
+card ID and content hash). Reports the bytes held per card, the build
+time and the time to read every field of every card.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stocard_cards import CardStore
+from stocard_loader import SyncDatabase
+from stocard_watch import identify
+from synth_db import generate
+
+
+def viewer_cards(db, user_id):
+    """Cards prepared the way the viewers keep them, with a fresh logo path per card"""
+    for card_id, card in db.iter_cards(user_id, with_ids=True):
+        card = {
+            'number': card['number'],
+            'label': card['label'] or 'Unnamed Card',
+            'provider_id': card['provider_id'],
+            'logo_path': os.path.join("logos", "display", f"{card['provider_id']}_100x100.png"),
+        }
+        yield identify(card, card_id)
+
+
+def measure(path, shape, container):
+    """Return (bytes held, build seconds, read seconds, cards) for one way of keeping cards"""
+    with SyncDatabase(path) as db:
+        user_id = db.user_ids()[0]
+        source = db.iter_cards(user_id) if shape == "loader" else viewer_cards(db, user_id)
+        tracemalloc.start()
+        start = time.perf_counter()
+        cards = CardStore(source) if container == "store" else list(source)
+        build = time.perf_counter() - start
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    start = time.perf_counter()
+    for card in cards:
+        for key in card.keys():
+            card[key]
+    read = time.perf_counter() - start
+    return held, build, read, cards
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--providers", type=int, default=500)
+    parser.add_argument("--path", default="bench_memory_sync_db")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    generate(args.path, args.cards + args.providers, args.cards, args.providers, with_index=True)
+    results = {"settings": vars(args)}
+    try:
+        for shape in ("loader", "viewer"):
+            baseline = None
+            for container in ("dicts", "store"):
+                held, build, read, cards = measure(args.path, shape, container)
+                if baseline is None:
+                    baseline = cards
+                else:
+                    assert [card.as_dict() for card in cards] == baseline, f"{shape} cards differ"
+                results[f"{shape}_{container}"] = {
+                    "bytes": held,
+                    "bytes_per_card": held / len(cards),
+                    "build_seconds": build,
+                    "read_seconds": read,
+                }
+                print(f"{shape:6s} {container:5s} {held / 2**20:7.1f} MiB "
+                      f"({held / len(cards):5.0f} B/card), build {build:.3f}s, read {read:.3f}s")
+            ratio = results[f"{shape}_store"]["bytes"] / results[f"{shape}_dicts"]["bytes"]
+            results[f"{shape}_ratio"] = ratio
+            print(f"{shape:6s} store holds {ratio:.0%} of the dicts' memory")
+    finally:
+        os.remove(args.path)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare card parsing in Python (json, orjson) with JSON1 projection in SQLite.
+
+    python benchmarks/bench_parse.py --cards 100000 --card-extra 0,600,2000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import stocard_loader
+from stocard_loader import SyncDatabase
+from synth_db import generate
+
+
+def load_cards(path, json1, fast_parser):
+    """Return (seconds, peak traced bytes, cards) for one pass over the cards"""
+    saved = stocard_loader.orjson
+    if not fast_parser:
+        stocard_loader.orjson = None
+    try:
+        with SyncDatabase(path) as db:
+            db._json1 = json1
+            user_id = db.user_ids()[0]
+            list(db.iter_cards(user_id))  # Warm the page cache and temporary index
+            start = time.perf_counter()
+            cards = list(db.iter_cards(user_id))
+            seconds = time.perf_counter() - start
+            tracemalloc.start()
+            for card in db.iter_cards(user_id):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        stocard_loader.orjson = saved
+    return seconds, peak, cards
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--card-extra", default="0,600,2000",
+                        help="comma separated extra JSON bytes per card")
+    parser.add_argument("--path", default="bench_sync_db")
+    args = parser.parse_args()
+
+    variants = [("json", False, False), ("json1", True, False)]
+    if stocard_loader.orjson is not None:
+        variants += [("orjson", False, True), ("json1+orjson", True, True)]
+    else:
+        print("orjson is not installed, skipping its variants")
+
+    for extra in (int(size) for size in args.card_extra.split(",")):
+        generate(args.path, args.cards * 2, args.cards, 100, with_index=True,
+                 malformed=args.cards // 100, card_extra=extra)
+        baseline = None
+        for name, json1, fast_parser in variants:
+            seconds, peak, cards = load_cards(args.path, json1, fast_parser)
+            if baseline is None:
+                baseline = cards
+            assert cards == baseline, f"{name} returned different cards"
+            print(f"extra={extra}B {name:13s} {seconds:.3f}s "
+                  f"({seconds / len(cards) * 1e6:.1f} us/card), peak {peak / 1024:.0f} KiB")
+    os.remove(args.path)
+
+
+if __name__ == "__main__":
+    main()
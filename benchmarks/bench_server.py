@@ -0,0 +1,166 @@
+"""Load-test stocard_server.py against a synthetic sync_db.
+
+    python benchmarks/bench_server.py --cards 2000 --connections 32 --duration 10
+
+Starts the server in its own process, then keeps --connections keep-alive
+connections busy for --duration seconds with a mix of card list, card,
+barcode and logo requests. A share of the requests (--revalidate) repeats
+an earlier one with If-None-Match, the way a browser revalidates its cache.
+Reports requests per second, latency percentiles, status codes and the
+server's own cache counters.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from synth_db import generate
+
+# Relative weight of each kind of request
+MIX = {"list": 1, "card": 20, "barcode": 50, "logo": 29}
+
+
+def make_path(kind, rng, cards, barcode_sizes):
+    index = rng.randrange(cards)
+    if kind == "list":
+        return "/cards"
+    if kind == "card":
+        return f"/cards/{index}"
+    if kind == "barcode":
+        width, height = rng.choice(barcode_sizes)
+        return f"/cards/{index}/barcode.png?width={width}&height={height}"
+    return f"/cards/{index}/logo.png?size={rng.choice((80, 100))}"
+
+
+async def request(reader, writer, path, etag=None):
+    """Send one GET on a keep-alive connection; return (status, etag, body length)"""
+    lines = [f"GET {path} HTTP/1.1", "Host: localhost"]
+    if etag:
+        lines.append(f"If-None-Match: {etag}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = {}
+    for line in head[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length:
+        await reader.readexactly(length)
+    return int(head[0].split(" ")[1]), headers.get("etag"), length
+
+
+async def client(port, deadline, rng, cards, revalidate, latencies, statuses, barcode_sizes):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 24)
+    seen = []
+    kinds, weights = zip(*MIX.items())
+    try:
+        while time.perf_counter() < deadline:
+            if seen and rng.random() < revalidate:
+                path, etag = rng.choice(seen)
+            else:
+                path, etag = make_path(rng.choices(kinds, weights)[0], rng, cards, barcode_sizes), None
+            start = time.perf_counter()
+            status, response_etag, _ = await request(reader, writer, path, etag)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if response_etag and etag is None and len(seen) < 1000:
+                seen.append((path, response_etag))
+    finally:
+        writer.close()
+
+
+async def get_json(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 24)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode("latin-1"))
+    data = await reader.read()
+    writer.close()
+    return json.loads(data.split(b"\r\n\r\n", 1)[1])
+
+
+async def load_test(port, args):
+    rng = random.Random(args.seed)
+    # A few fixed sizes, as real clients ask for the size of their screen
+    barcode_sizes = [(400, 100), (350, 80), (600, 150)]
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, deadline, random.Random(rng.random()), args.cards, args.revalidate,
+                                  latencies, statuses, barcode_sizes)
+                           for _ in range(args.connections)))
+    elapsed = time.perf_counter() - start
+    server_stats = await get_json(port, "/stats")
+    return latencies, statuses, elapsed, server_stats
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=2000)
+    parser.add_argument("--providers", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=20000, help="total rows in the synthetic backup")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--revalidate", type=float, default=0.3,
+                        help="share of requests repeated with If-None-Match")
+    parser.add_argument("--workers", type=int, default=4, help="server render threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--path", default="bench_server_sync_db")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    generate(args.path, max(args.rows, args.cards + args.providers), args.cards, args.providers, with_index=True)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "stocard_server.py"), args.path,
+                               "--port", "0", "--workers", str(args.workers)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        port = None
+        for line in server.stdout:
+            print(f"server: {line.rstrip()}")
+            if line.startswith("Serving on "):
+                port = int(line.rstrip().rstrip("/").rsplit(":", 1)[1])
+                break
+        if port is None:
+            sys.exit("The server did not start")
+
+        latencies, statuses, elapsed, server_stats = asyncio.run(load_test(port, args))
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(args.path)
+
+    latencies.sort()
+    results = {
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_ms": {name: percentile(latencies, fraction) * 1000
+                       for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "server": server_stats,
+        "settings": vars(args),
+    }
+    print(f"{results['requests']} requests in {elapsed:.1f}s over {args.connections} connections: "
+          f"{results['requests_per_second']:.0f} req/s")
+    print("latency ms: " + ", ".join(f"{name} {ms:.1f}" for name, ms in results["latency_ms"].items()))
+    print(f"statuses: {results['statuses']}")
+    print(f"server: {server_stats}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
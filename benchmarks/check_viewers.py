@@ -0,0 +1,189 @@
+"""Drive the viewers under Tk and check what they lay out.
+
+    python benchmarks/check_viewers.py --cards 300
+
+Generates and extracts a synthetic sync_db and opens each viewer on it.
+stocard_gui.py: every card fits the slot it is drawn in, at the top,
+middle and end of the list and while searching. stocard_viewer.py: tabs
+keep their order, the selected tab is built and only the last viewed
+ones stay built, while cycling through more tabs than are kept alive
+and while searching, finding nothing and clearing the search. Like
+run_benchmarks.py it starts an offscreen Xvfb when there is no display;
+without one the checks are reported as skipped. Exits with status 1 if
+a check fails.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from run_benchmarks import start_display
+from stocard_extractor import extract
+from synth_db import generate
+
+
+def pump(root, done, timeout):
+    """Run the Tk event loop until done() is true or timeout seconds pass; return done()"""
+    end = time.perf_counter() + timeout
+    root.update()
+    while not done() and time.perf_counter() < end:
+        time.sleep(0.001)
+        root.update()
+    root.update_idletasks()
+    return done()
+
+
+def check_gui(timeout):
+    """Problems found in stocard_gui.py's card slots, as a list of strings"""
+    import tkinter as tk
+    from stocard_gui import CARD_GAP, HEADER_HEIGHT, StocardGUI
+
+    problems = []
+    app = StocardGUI(tk.Tk())
+    root = app.root
+    try:
+        def images_ready():
+            return all(str(widget.barcode_label.cget("text")) != "Generating barcode..."
+                       for widget in app.visible_widgets.values())
+
+        def check_slots(where):
+            if not pump(root, images_ready, timeout):
+                problems.append(f"gui {where}: images not shown after {timeout}s")
+            for slot, widget in sorted(app.visible_widgets.items()):
+                height = widget.frame.winfo_reqheight()
+                if height > app.card_height - CARD_GAP:
+                    problems.append(f"gui {where}: slot {slot} needs {height}px, "
+                                    f"has {app.card_height - CARD_GAP}px")
+                top = app.canvas.coords(widget.window)[1]
+                if top != HEADER_HEIGHT + slot * app.card_height + CARD_GAP // 2:
+                    problems.append(f"gui {where}: slot {slot} drawn at y={top}")
+                index = slot if app.view is None else app.view[slot]
+                if widget.index != index:
+                    problems.append(f"gui {where}: slot {slot} shows card {widget.index}, not {index}")
+
+        if not pump(root, lambda: not app.progress.winfo_manager(), timeout):
+            return [f"gui: cards not loaded after {timeout}s"]
+        check_slots("top")
+        app.canvas.yview_moveto(0.5)
+        check_slots("middle")
+        app.canvas.yview_moveto(1.0)
+        check_slots("end")
+        if app.view_size() - 1 not in app.visible_widgets:
+            problems.append("gui end: the last card is not shown")
+
+        app.search_var.set("Card 1")
+        check_slots("search")
+        app.search_var.set("")
+        if app.view is not None:
+            problems.append("gui: clearing the search did not show every card")
+        check_slots("search cleared")
+    finally:
+        app.on_close()
+    return problems
+
+
+def check_viewer(timeout):
+    """Problems found in stocard_viewer.py's tabs, as a list of strings"""
+    import tkinter as tk
+    from stocard_viewer import StocardViewerSimple
+
+    problems = []
+    app = StocardViewerSimple(tk.Tk())
+    root = app.root
+    notebook = app.notebook
+    try:
+        def check_tabs(where, query=""):
+            root.update()
+            if [str(tab) for tab in notebook.tabs()] != [str(frame) for frame in app.tab_frames]:
+                problems.append(f"viewer {where}: tabs out of order")
+            for i, frame in enumerate(app.tab_frames):
+                if notebook.tab(frame, "text") != app.tab_text(i, app.cards_data[i]):
+                    problems.append(f"viewer {where}: tab {i} reads {notebook.tab(frame, 'text')!r}")
+                hidden = notebook.tab(frame, "state") == "hidden"
+                if hidden != (i in app.hidden_tabs):
+                    problems.append(f"viewer {where}: tab {i} hidden={hidden}, expected {not hidden}")
+                elif query.strip() and hidden == app.search.matches(i, query):
+                    problems.append(f"viewer {where}: tab {i} hidden={hidden} for {query!r}")
+                built = bool(frame.winfo_children())
+                if built != (i in app.live_tabs):
+                    problems.append(f"viewer {where}: tab {i} built={built}, live={i in app.live_tabs}")
+            if len(app.live_tabs) > app.max_live_tabs:
+                problems.append(f"viewer {where}: {len(app.live_tabs)} tabs built")
+            selected = notebook.select()
+            shown = len(app.tab_frames) - len(app.hidden_tabs)
+            if not selected:
+                if shown:
+                    problems.append(f"viewer {where}: no tab selected, {shown} shown")
+                return None
+            index = notebook.index(selected)
+            if index in app.hidden_tabs or index not in app.live_tabs:
+                problems.append(f"viewer {where}: selected tab {index} is hidden or not built")
+            return index
+
+        def cycle(where, indexes):
+            for index in indexes:
+                notebook.select(app.tab_frames[index])
+                pump(root, lambda: index in app.live_tabs, timeout)
+                if check_tabs(f"{where} tab {index}", app.search_var.get()) != index:
+                    problems.append(f"viewer {where}: selecting tab {index} did not stick")
+
+        if not pump(root, lambda: not app.progress.winfo_manager(), timeout):
+            return [f"viewer: cards not loaded after {timeout}s"]
+        count = min(len(app.tab_frames), app.max_live_tabs * 2 + 5)
+        check_tabs("loaded")
+        cycle("forward", range(count))
+        cycle("back", range(count - 1, -1, -1))
+
+        app.search_var.set("Card 1")
+        check_tabs("search", "Card 1")
+        matches = [i for i in range(len(app.tab_frames)) if i not in app.hidden_tabs]
+        cycle("search", matches[:count])
+        app.search_var.set("zzzz")
+        check_tabs("no matches", "zzzz")
+        if len(app.hidden_tabs) != len(app.tab_frames):
+            problems.append("viewer no matches: a tab is still shown")
+        app.search_var.set("")
+        check_tabs("search cleared")
+        cycle("search cleared", range(count))
+    finally:
+        app.on_close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed per step")
+    args = parser.parse_args()
+
+    xvfb, skip = start_display()
+    if skip:
+        print(f"Skipped: {skip}")
+        return
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="stocard-check-viewers-")
+    try:
+        # The viewers read ./sync_db and ./logos
+        providers = max(args.cards // 5, 5)
+        generate(os.path.join(workdir, "sync_db"), args.cards + providers, args.cards, providers)
+        extract(os.path.join(workdir, "sync_db"), workdir)
+        os.chdir(workdir)
+        problems = check_gui(args.timeout) + check_viewer(args.timeout)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if xvfb:
+            xvfb.terminate()
+
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} problems" if problems else "All checks passed")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
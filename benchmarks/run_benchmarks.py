@@ -0,0 +1,251 @@
+"""Time every stage of the tools on synthetic backups and write JSON results.
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000,1000000 --output results.json
+
+For each size a sync_db is generated (with and without an index on
+collection), then user discovery, the card query, JSON parsing, logo
+extraction, barcode rendering and both viewers' construction are timed.
+The viewers need a display: an offscreen Xvfb is started when there is
+none and Xvfb is installed, otherwise the GUI stages are reported as
+skipped. Pass --baseline with an earlier results file to see the change
+per stage.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stocard_barcode import render_code128
+from stocard_extractor import extract_cards
+from stocard_loader import SyncDatabase, card_from_content
+from synth_db import generate
+
+
+def best_of(repeat, fn, *args):
+    """Run fn repeat times; return (fastest seconds, last result)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def workload(rows):
+    """Cards, providers, deleted and malformed rows for a backup of `rows` rows"""
+    cards = max(rows // 100, 10)
+    return {
+        "cards": cards,
+        "providers": max(cards // 5, 5),
+        "users": 3,
+        "deleted": max(cards // 20, 1),
+        "malformed": max(cards // 50, 1),
+    }
+
+
+def bench_data(path, repeat, barcodes):
+    """Time the non-GUI stages against one database"""
+    stages = {}
+    with SyncDatabase(path) as db:
+        seconds, users = best_of(repeat, db.user_ids)
+        stages["user_discovery"] = {"seconds": seconds, "items": len(users)}
+        user_id = users[0]
+
+        seconds, rows = best_of(repeat, lambda: list(db.iter_card_rows(user_id)))
+        stages["card_query"] = {"seconds": seconds, "items": len(rows)}
+
+        def parse():
+            return [card for card in (card_from_content(row[2]) for row in rows) if card]
+
+        seconds, cards = best_of(repeat, parse)
+        stages["json_parse"] = {"seconds": seconds, "items": len(cards)}
+
+        def extract_logos():
+            logo_dir = tempfile.mkdtemp(prefix="stocard-bench-logos-")
+            try:
+                return sum(1 for card in extract_cards(db, user_id, logo_dir) if card['logo_path'])
+            finally:
+                shutil.rmtree(logo_dir, ignore_errors=True)
+
+        seconds, logos = best_of(repeat, extract_logos)
+        stages["logo_extraction"] = {"seconds": seconds, "items": logos}
+
+    numbers = [card['number'] for card in cards[:barcodes]]
+    seconds, _ = best_of(repeat, lambda: [render_code128(n, (400, 100)) for n in numbers])
+    stages["barcode_render"] = {"seconds": seconds, "items": len(numbers)}
+    return stages
+
+
+def start_display():
+    """Make sure Tk can open a window; return (Xvfb process or None, skip reason)"""
+    import tkinter as tk
+
+    try:
+        tk.Tk().destroy()
+        return None, None
+    except tk.TclError as e:
+        reason = str(e)
+    if not shutil.which("Xvfb"):
+        return None, f"no display and Xvfb not installed ({reason})"
+
+    display = ":99"
+    xvfb = subprocess.Popen(["Xvfb", display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+    for _ in range(50):
+        try:
+            tk.Tk().destroy()
+            return xvfb, None
+        except tk.TclError:
+            time.sleep(0.1)
+    xvfb.terminate()
+    return None, "Xvfb did not start"
+
+
+def bench_gui(app_class, batch_method, path, timeout):
+    """Time one viewer from construction to its first batch and to fully loaded"""
+    import tkinter as tk
+
+    marks = {}
+    start = time.perf_counter()
+
+    def on_batch(self, cards):
+        getattr(app_class, batch_method)(self, cards)
+        marks.setdefault("first_batch", time.perf_counter() - start)
+
+    def on_load_done(self, error):
+        app_class.on_load_done(self, error)
+        marks.setdefault("loaded", time.perf_counter() - start)
+
+    timed = type(f"Timed{app_class.__name__}", (app_class,),
+                 {batch_method: on_batch, "on_load_done": on_load_done})
+
+    # The viewers read ./sync_db and ./logos, so run them from a scratch dir
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="stocard-bench-gui-")
+    os.symlink(os.path.abspath(path), os.path.join(workdir, "sync_db"))
+    os.chdir(workdir)
+    root = tk.Tk()
+    try:
+        app = timed(root)
+        marks["constructed"] = time.perf_counter() - start
+        while "loaded" not in marks and time.perf_counter() - start < timeout:
+            root.update()
+            time.sleep(0.001)
+        app.loader.close()
+    finally:
+        root.destroy()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if "loaded" not in marks:
+        return {"skipped": f"not loaded after {timeout}s"}
+    return {"seconds": marks["loaded"], "constructed": marks["constructed"],
+            "first_batch": marks.get("first_batch", marks["loaded"])}
+
+
+def run(sizes, indexes, repeat, barcodes, gui, gui_timeout, workdir):
+    xvfb, skip = start_display() if gui else (None, "disabled with --no-gui")
+    viewers = []
+    if not skip:
+        from stocard_gui import StocardGUI
+        from stocard_viewer import StocardViewerSimple
+        viewers = [("gui_scroll_list", StocardGUI, "on_cards_loaded"),
+                   ("gui_tabs", StocardViewerSimple, "create_card_tabs")]
+    runs = []
+    try:
+        for rows in sizes:
+            params = workload(rows)
+            for with_index in indexes:
+                path = os.path.join(workdir, f"sync_db_{rows}_{'index' if with_index else 'noindex'}")
+                if not os.path.exists(path):
+                    generate(path, rows, with_index=with_index, **params)
+                stages = bench_data(path, repeat, barcodes)
+                for name, app_class, batch_method in viewers:
+                    stages[name] = bench_gui(app_class, batch_method, path, gui_timeout)
+                if skip:
+                    stages["gui_scroll_list"] = stages["gui_tabs"] = {"skipped": skip}
+                runs.append(dict(params, rows=rows, index=with_index, stages=stages))
+                print(summary_line(runs[-1]))
+    finally:
+        if xvfb:
+            xvfb.terminate()
+    return runs
+
+
+def summary_line(entry):
+    parts = []
+    for name, stage in entry["stages"].items():
+        parts.append(f"{name}={stage['seconds']:.3f}s" if "seconds" in stage else f"{name}=skipped")
+    return f"rows={entry['rows']} index={entry['index']}: " + " ".join(parts)
+
+
+def compare(runs, baseline_path):
+    """Print each stage's time relative to a previous results file"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["rows"], r["index"]): r["stages"] for r in json.load(f)["runs"]}
+    for entry in runs:
+        old = baseline.get((entry["rows"], entry["index"]))
+        if not old:
+            continue
+        for name, stage in entry["stages"].items():
+            before = old.get(name, {}).get("seconds")
+            if before and "seconds" in stage:
+                print(f"rows={entry['rows']} index={entry['index']} {name}: "
+                      f"{before:.3f}s -> {stage['seconds']:.3f}s ({stage['seconds'] / before:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma separated row counts")
+    parser.add_argument("--index", choices=("both", "yes", "no"), default="both",
+                        help="benchmark backups with an index on collection, without, or both")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--barcodes", type=int, default=1000, help="cards to render barcodes for")
+    parser.add_argument("--no-gui", action="store_true", help="skip the viewer stages")
+    parser.add_argument("--gui-timeout", type=float, default=300, help="seconds allowed per viewer")
+    parser.add_argument("--workdir", default=None, help="where to keep generated databases (default: temp)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    indexes = {"both": (False, True), "yes": (True,), "no": (False,)}[args.index]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="stocard-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        runs = run(sizes, indexes, args.repeat, args.barcodes, not args.no_gui,
+                   args.gui_timeout, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare(runs, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Build a synthetic Stocard sync_db for benchmarking.
+
+    python benchmarks/synth_db.py --rows 1000000 --output bench_sync_db
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+
+# Smallest valid PNG, used as provider logo payload
+PNG_1X1 = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63f8cfc0f01f00050001ff89993d1d"
+    "0000000049454e44ae426082"
+)
+
+SCHEMA = """
+    CREATE TABLE synced_resources (
+        collection TEXT,
+        content BLOB,
+        content_type TEXT,
+        deleted INTEGER DEFAULT 0
+    )
+"""
+
+
+def generate(path, rows=100000, cards=200, providers=50, user_id="5f2a9c1e",
+             logo_size=4096, with_index=False, seed=0, users=1, deleted=0, malformed=0,
+             card_extra=0):
+    """Write a synced_resources table with users, cards, logos and filler rows.
+
+    Every user gets `cards` live cards. On top of those, the first user gets
+    `deleted` cards marked deleted and `malformed` cards whose JSON is cut
+    short, and the same numbers of deleted and malformed filler rows are
+    mixed into the noise. Only user_id has the record holding
+    distinct_backend_id, so it is the user the tools pick, though other
+    ids sort below it: the first extra user always does, and with deleted
+    cards a stale id whose rows are all deleted comes first of all.
+    card_extra adds about that many bytes of usage history to every card,
+    as real cards carry far more than the fields used.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+
+    user_ids = [user_id]
+    while len(user_ids) < users:
+        other_id = f"{rng.randrange(16**8):08x}"
+        # The first other user sorts before the owner, so picking the lowest id is wrong
+        if (other_id < user_id or len(user_ids) > 1) and other_id not in user_ids:
+            user_ids.append(other_id)
+    # Left behind by an earlier login: deleted rows only
+    stale_id = "0" * len(user_id)
+
+    def filler(count):
+        for i in range(count):
+            # Sync noise: offers, points history, analytics events
+            kind = rng.choice(("offers", "points", "events"))
+            content = json.dumps({
+                "id": i, "kind": kind, "payload": "x" * rng.randint(100, 400),
+            })
+            yield (f"/{kind}/{rng.randrange(10**9)}/{i}", content, "application/json", 0)
+
+    def broken_filler(count):
+        for row in filler(count):
+            collection, content, content_type, _ = row
+            if rng.random() < 0.5:
+                yield (collection, content, content_type, 1)
+            else:
+                yield (collection, content[:len(content) // 2], content_type, 0)
+
+    def card_content(i):
+        provider = rng.randrange(providers)
+        card = {
+            "input_id": f"{rng.randrange(10**12):012d}",
+            "label": f"Card {i}" if i % 3 else None,
+            "input_provider_reference": {"identifier": f"/loyalty-card-providers/{provider}"},
+        }
+        if card_extra:
+            card["usage"] = [{"time": 1600000000000 + j, "location": "store"}
+                             for j in range(card_extra // 48)]
+        return json.dumps(card)
+
+    def loyalty_cards():
+        for uid in user_ids:
+            for i in range(cards):
+                yield (f"/users/{uid}/loyalty-cards/{i}", card_content(i), "application/json", 0)
+        for i in range(cards, cards + deleted):
+            yield (f"/users/{user_id}/loyalty-cards/{i}", card_content(i), "application/json", 1)
+        if deleted and stale_id < user_id:
+            yield (f"/users/{stale_id}/loyalty-cards/0", card_content(0), "application/json", 1)
+        for i in range(cards + deleted, cards + deleted + malformed):
+            content = card_content(i)
+            yield (f"/users/{user_id}/loyalty-cards/{i}", content[:len(content) // 2],
+                   "application/json", 0)
+
+    def logos():
+        for provider in range(providers):
+            image = PNG_1X1 + bytes(logo_size)
+            yield (f"/loyalty-card-providers/{provider}/logo", image, "image/png", 0)
+
+    def user_rows():
+        yield (f"/users/{user_id}", json.dumps({"distinct_backend_id": user_id}), "application/json", 0)
+
+    insert = "INSERT INTO synced_resources VALUES (?, ?, ?, ?)"
+    special = len(user_ids) * cards + 1 + providers + 2 * (deleted + malformed) + (1 if deleted else 0)
+    other = max(rows - special, 0)
+    # Spread the interesting rows through the noise so scans cannot stop early
+    conn.executemany(insert, filler(other // 2))
+    conn.executemany(insert, loyalty_cards())
+    conn.executemany(insert, broken_filler(deleted + malformed))
+    conn.executemany(insert, logos())
+    conn.executemany(insert, filler(other - other // 2))
+    conn.executemany(insert, user_rows())
+    if with_index:
+        conn.execute("CREATE INDEX synced_resources_collection ON synced_resources (collection)")
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="bench_sync_db")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--providers", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--deleted", type=int, default=0, help="deleted cards and filler rows")
+    parser.add_argument("--malformed", type=int, default=0, help="cards and filler rows with broken JSON")
+    parser.add_argument("--card-extra", type=int, default=0, help="extra bytes of JSON per card")
+    parser.add_argument("--index", action="store_true", help="create an index on collection")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.output, args.rows, args.cards, args.providers, with_index=args.index,
+             seed=args.seed, users=args.users, deleted=args.deleted, malformed=args.malformed,
+             card_extra=args.card_extra)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stocard_cards import CardStore
+from stocard_loader import SyncDatabase
+from stocard_metrics import NULL_METRICS
+from stocard_watch import CardReload, diff_cards, identify
+
+
+class BackgroundLoader:
+    """Runs SQLite reads and PIL work off the Tk thread.
+
+    Work happens in a reader thread and a small thread pool; callbacks are
+    queued and run on the Tk thread by an after() poll, so the mainloop
+    never blocks. Callbacks must do the Tk-only work, such as creating
+    ImageTk.PhotoImage objects.
+    """
+
+    def __init__(self, root, workers=4, poll_ms=30, tick_budget=0.015, metrics=None):
+        self.root = root
+        self.metrics = metrics or NULL_METRICS
+        self.poll_ms = poll_ms
+        self.tick_budget = tick_budget
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self._futures = set()  # Submitted and not finished, cancelled on close
+        self.results = queue.Queue()
+        self.closed = False
+        self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def _post(self, callback, *args):
+        if not self.closed:
+            self.results.put((callback, args))
+
+    def _poll(self):
+        # Run queued callbacks, but give the UI back after a frame's worth
+        deadline = time.perf_counter() + self.tick_budget
+        while time.perf_counter() < deadline:
+            try:
+                callback, args = self.results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in background callback {callback}: {e}")
+        if not self.closed:
+            self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, func, *args, callback=None):
+        """Run func(*args) in the pool and callback(result) on the Tk thread"""
+        def run():
+            try:
+                result = func(*args)
+            except Exception as e:
+                print(f"Error in background task {func}: {e}")
+                result = None
+            if callback is not None:
+                self._post(callback, result)
+        future = self.pool.submit(run)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def load_cards(self, db_path, prepare_card, on_start, on_batch, on_done, batch_size=50, with_ids=False):
+        """Stream cards from db_path on a reader thread.
+
+        prepare_card(card) runs on the reader thread and returns the dict
+        the viewer keeps. On the Tk thread, on_start(user_id, total) runs
+        first, then on_batch(cards) per batch, then on_done(error), where
+        error is None on success. with_ids tags the prepared cards with
+        card_id and content_hash, which watch mode diffs reloads against;
+        the backup is then not opened as immutable, as it may change.
+        """
+        def read():
+            try:
+                with SyncDatabase(db_path, self.metrics, immutable=False if with_ids else None) as db:
+                    users = db.user_ids()
+                    if not users:
+                        self._post(on_start, None, 0)
+                        self._post(on_done, None)
+                        return
+                    self._post(on_start, users[0], db.count_cards(users[0]))
+
+                    batch = []
+                    for card in db.iter_cards(users[0], batch_size, with_ids):
+                        if self.closed:
+                            return
+                        if with_ids:
+                            card_id, card = card
+                            batch.append(identify(prepare_card(card), card_id))
+                        else:
+                            batch.append(prepare_card(card))
+                        if len(batch) >= batch_size:
+                            self._post(on_batch, batch)
+                            batch = []
+                    if batch:
+                        self._post(on_batch, batch)
+                self._post(on_done, None)
+            except Exception as e:
+                self._post(on_done, e)
+
+        thread = threading.Thread(target=read, name="stocard-card-reader", daemon=True)
+        thread.start()
+        return thread
+
+    def load_snapshot(self, snapshot, prepare_card, on_start, on_batch, on_done, batch_size=200):
+        """Like load_cards, but read a stocard_snapshot.CardSnapshot; no SQL at all.
+
+        prepare_card may be None when the snapshot's card dicts can be used as is.
+        """
+        def read():
+            try:
+                self._post(on_start, snapshot.user_id, len(snapshot))
+                for start in range(0, len(snapshot), batch_size):
+                    if self.closed:
+                        return
+                    end = min(start + batch_size, len(snapshot))
+                    cards = [snapshot[index] for index in range(start, end)]
+                    if prepare_card is not None:
+                        cards = [prepare_card(card) for card in cards]
+                    self._post(on_batch, cards)
+                self._post(on_done, None)
+            except Exception as e:
+                self._post(on_done, e)
+
+        thread = threading.Thread(target=read, name="stocard-snapshot-reader", daemon=True)
+        thread.start()
+        return thread
+
+    def reload_cards(self, db_path, prepare_card, old_cards, on_done, batch_size=500):
+        """Read all cards of db_path again on a reader thread and diff them with old_cards.
+
+        Cards are prepared and tagged like load_cards(with_ids=True) and
+        kept in a CardStore. Then on_done(CardReload(user_id, cards, diff),
+        None) runs on the Tk thread, or on_done(None, error). The backup is
+        not opened as immutable, since it is one that is known to change.
+        """
+        def read():
+            try:
+                cards = CardStore()
+                with SyncDatabase(db_path, self.metrics, immutable=False) as db:
+                    users = db.user_ids()
+                    if users:
+                        for card_id, card in db.iter_cards(users[0], batch_size, with_ids=True):
+                            if self.closed:
+                                return
+                            cards.append(identify(prepare_card(card), card_id))
+                with self.metrics.stage("reload_diff") as stage:
+                    diff = diff_cards(old_cards, cards)
+                    stage.count(rows=len(cards))
+                self._post(on_done, CardReload(users[0] if users else None, cards, diff), None)
+            except Exception as e:
+                self._post(on_done, None, e)
+
+        thread = threading.Thread(target=read, name="stocard-card-reloader", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """Stop polling and drop pending work"""
+        self.closed = True
+        try:
+            self.root.after_cancel(self._poll_id)
+        except Exception:
+            pass
+        # Queued logo and barcode jobs are dropped, so they do not hold up exit
+        # (by hand: shutdown(cancel_futures=True) needs Python 3.9)
+        for future in list(self._futures):
+            future.cancel()
+        self.pool.shutdown(wait=False)
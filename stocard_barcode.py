@@ -0,0 +1,189 @@
+import threading
+from collections import OrderedDict
+
+# Bump when rendering changes, so clients do not reuse stale bitmaps
+RENDER_VERSION = 3
+
+# Code 128 symbol widths (bar, space, bar, ...) for values 0-105
+CODE128_WIDTHS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312',
+    '132212', '221213', '221312', '231212', '112232', '122132', '122231', '113222',
+    '123122', '123221', '223211', '221132', '221231', '213212', '223112', '312131',
+    '311222', '321122', '321221', '312212', '322112', '322211', '212123', '212321',
+    '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121',
+    '313121', '211331', '231131', '213113', '213311', '213131', '311123', '311321',
+    '331121', '312113', '312311', '332111', '314111', '221411', '431111', '111224',
+    '111422', '121124', '121421', '141122', '141221', '112214', '112412', '122114',
+    '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112',
+    '421211', '212141', '214121', '412121', '111143', '111341', '131141', '114113',
+    '114311', '411113', '411311', '113141', '114131', '311141', '411131', '211412',
+    '211214', '211232',
+)
+CODE128_STOP = '2331112'
+
+_COMMON = "".join(chr(c) for c in range(32, 96))
+# The function characters use the same stand-ins as python-barcode
+_CODE128_SETS = {
+    'A': dict({c: i for i, c in enumerate(_COMMON + "".join(chr(c) for c in range(32)))},
+              **{"ó": 96, "ò": 97, "TO_C": 99, "TO_B": 100, "ô": 101, "ñ": 102}),
+    'B': dict({c: i for i, c in enumerate(_COMMON + "".join(chr(c) for c in range(96, 128)))},
+              **{"ó": 96, "ò": 97, "TO_C": 99, "ô": 100, "TO_A": 101, "ñ": 102}),
+    'C': {"TO_B": 100, "TO_A": 101, "ñ": 102},
+}
+_CODE128_START = {'A': 103, 'B': 104, 'C': 105}
+
+
+def code128_values(code):
+    """Return the Code 128 symbol values for code, checksum included.
+
+    Charset switching follows python-barcode step for step, so the bars
+    match what it draws. The exception is a code starting with "99", where
+    python-barcode folds the 99 into the start symbol and loses it.
+    """
+    code = str(code)
+    for char in code:
+        if char not in _CODE128_SETS['A'] and char not in _CODE128_SETS['B']:
+            raise ValueError(f"Character {char!r} cannot be encoded in Code 128")
+
+    charset = 'C'
+    buffer = ""
+    values = [_CODE128_START['C']]
+    switches = set()
+
+    def switch(which):
+        nonlocal charset
+        if which == charset:
+            raise ValueError(f"Already in charset {which}")
+        switches.add(len(values))
+        values.append(_CODE128_SETS[charset][f"TO_{which}"])
+        charset = which
+
+    def convert(char):
+        nonlocal buffer
+        if charset != 'C':
+            return _CODE128_SETS[charset][char]
+        if char in _CODE128_SETS['C']:
+            return _CODE128_SETS['C'][char]
+        if char.isdigit():
+            buffer += char
+            if len(buffer) == 2:
+                value = int(buffer)
+                buffer = ""
+                return value
+            return None
+        raise ValueError(f"Character {char!r} could not be converted in charset {charset}")
+
+    def digits_ahead(pos):
+        digits = 0
+        for char in code[pos:pos + 10]:
+            if not char.isdigit():
+                break
+            digits += 1
+        return digits > 3
+
+    for pos, char in enumerate(code):
+        # Switch charset where python-barcode would
+        if charset == 'C' and not char.isdigit():
+            switch('B' if char in _CODE128_SETS['B'] else 'A')
+            if len(buffer) == 1:
+                values.append(convert(buffer))
+                buffer = ""
+        elif charset in ('A', 'B'):
+            other = 'A' if charset == 'B' else 'B'
+            if digits_ahead(pos):
+                switch('C')
+            elif char not in _CODE128_SETS[charset] and char in _CODE128_SETS[other]:
+                switch(other)
+
+        value = convert(char)
+        if value is not None:
+            values.append(value)
+
+    if len(buffer) == 1:
+        switch('B')
+        values.append(convert(buffer))
+
+    # A switch right after the start symbol becomes the start symbol
+    if 1 in switches:
+        values[:2] = [_CODE128_START[{99: 'C', 100: 'B', 101: 'A'}[values[1]]]]
+
+    checksum = values[0] + sum(i * value for i, value in enumerate(values[1:], start=1))
+    values.append(checksum % 103)
+    return values
+
+
+def code128_modules(code):
+    """Return the module pattern of code as a '1' (bar) / '0' (space) string"""
+    widths = "".join(CODE128_WIDTHS[value] for value in code128_values(code)) + CODE128_STOP
+    return "".join(("1" if i % 2 == 0 else "0") * int(w) for i, w in enumerate(widths))
+
+
+# Code 128 needs at least 10 modules of quiet zone on both sides
+QUIET_MODULES = 10
+_PIXEL = {"1": b"\x00", "0": b"\xff"}
+
+
+def rasterize_modules(modules, size):
+    """Draw a module pattern straight into a 1-bit image of size=(width, height).
+
+    Modules get a whole number of pixels each, so every bar is crisp; the
+    pattern is centred with at least the quiet zone on both sides when it
+    fits. A pattern that only fits without the full quiet zone is drawn a
+    pixel per module with what margin is left; one wider than the image
+    raises ValueError, since squeezing it would drop bars.
+    """
+    from PIL import Image
+
+    width, height = size
+    count = len(modules)
+    if count > width:
+        raise ValueError(f"Barcode of {count} modules does not fit in {width} pixels")
+    scale = max(width // (count + 2 * QUIET_MODULES), 1)
+    bars = b"".join(_PIXEL[m] * scale for m in modules)
+    left = (width - len(bars)) // 2
+    row = b"\xff" * left + bars + b"\xff" * (width - left - len(bars))
+    return Image.frombytes("L", size, row * height).convert("1", dither=Image.Dither.NONE)
+
+
+def render_code128(card_number, size):
+    """Render a Code 128 barcode at size=(width, height)"""
+    return rasterize_modules(code128_modules(card_number), tuple(size))
+
+
+class BarcodeCache:
+    """Rendered barcode bitmaps, kept in memory.
+
+    Entries are keyed on card number, symbology and pixel size, and the
+    least recently used are dropped beyond max_items. There is no disk
+    tier: rendering a Code 128 bitmap is quicker than reading one back
+    from a file. Safe to share between threads.
+    """
+
+    renderers = {'code128': render_code128}
+
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, card_number, size, symbology='code128'):
+        """Return the barcode as a PIL image, rendering it only on a miss"""
+        key = (symbology, card_number, tuple(size))
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                return image
+
+        image = self.renderers[symbology](card_number, key[2])
+        with self._lock:
+            self._memory[key] = image
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+        return image
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
@@ -0,0 +1,146 @@
+"""Extract many Stocard backups in parallel.
+
+    python stocard_batch.py backups/ other/sync_db --output out --workers 8
+
+Every backup is extracted in its own process into out/<name>-<hash>/
+(cards.jsonl and logos/), and one line per backup is appended to
+out/manifest.jsonl. A backup that hangs past --timeout is killed, and one
+that is corrupt or crashes its worker only fails its own manifest line.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+
+def find_backups(paths, name="sync_db"):
+    """Expand directories into the backup files they contain"""
+    backups = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                if name in filenames:
+                    backups.append(os.path.join(dirpath, name))
+        else:
+            backups.append(path)
+    return backups
+
+
+def output_dir_for(backup, output_root):
+    """Stable, collision-free output directory for one backup"""
+    abspath = os.path.abspath(backup)
+    digest = hashlib.sha1(abspath.encode("utf-8")).hexdigest()[:10]
+    parent = os.path.basename(os.path.dirname(abspath)) or "backup"
+    return os.path.join(output_root, f"{parent}-{digest}")
+
+
+def extract_backup(backup, out_dir, incremental=False):
+    """Extract one backup into out_dir and return its summary"""
+    from stocard_extractor import extract
+
+    if not os.path.isfile(backup):
+        raise FileNotFoundError(backup)
+
+    # Each backup already has its own process, so render thumbnails in this one
+    result = extract(backup, out_dir, incremental, thumbnail_workers=1)
+    del result["out_dir"]  # The manifest line has it as "output"
+    return result
+
+
+def _worker(backup, out_dir, incremental, conn):
+    try:
+        result = {"status": "ok"}
+        result.update(extract_backup(backup, out_dir, incremental))
+    except Exception as e:
+        result = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    conn.send(result)
+    conn.close()
+
+
+def run_batch(backups, output_root, workers=None, timeout=600, manifest_path=None,
+              incremental=False):
+    """Extract backups with up to `workers` processes; return failure count"""
+    workers = workers or os.cpu_count() or 1
+    manifest_path = manifest_path or os.path.join(output_root, "manifest.jsonl")
+    os.makedirs(output_root, exist_ok=True)
+    ctx = multiprocessing.get_context("spawn")
+
+    pending = deque(backups)
+    running = {}
+    failures = 0
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        while pending or running:
+            # Keep the pool full
+            while pending and len(running) < workers:
+                backup = pending.popleft()
+                out_dir = output_dir_for(backup, output_root)
+                recv, send = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_worker, args=(backup, out_dir, incremental, send), daemon=True)
+                process.start()
+                send.close()
+                running[process.sentinel] = (process, recv, backup, out_dir, time.monotonic())
+
+            deadline = min(entry[4] for entry in running.values()) + timeout
+            ready = wait(list(running), timeout=max(deadline - time.monotonic(), 0))
+
+            now = time.monotonic()
+            for sentinel in list(running):
+                process, recv, backup, out_dir, started = running[sentinel]
+                if sentinel in ready:
+                    process.join()
+                    if recv.poll():
+                        result = recv.recv()
+                    else:
+                        result = {"status": "error",
+                                  "error": f"worker exited with code {process.exitcode}"}
+                elif now - started >= timeout:
+                    process.terminate()
+                    process.join()
+                    result = {"status": "timeout", "error": f"no result after {timeout}s"}
+                else:
+                    continue
+
+                del running[sentinel]
+                recv.close()
+                if result["status"] != "ok":
+                    failures += 1
+                entry = {"backup": os.path.abspath(backup), "output": out_dir,
+                         "seconds": round(now - started, 3)}
+                entry.update(result)
+                manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+                print(f"[{result['status']}] {backup} -> {out_dir}")
+    return failures
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="sync_db files or directories to search")
+    parser.add_argument("--output", default="batch_output", help="root output directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds allowed per backup")
+    parser.add_argument("--manifest", default=None, help="JSON Lines manifest (default: OUTPUT/manifest.jsonl)")
+    parser.add_argument("--name", default="sync_db", help="backup file name to look for in directories")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process rows changed since each output's last checkpoint")
+    args = parser.parse_args(argv)
+
+    backups = find_backups(args.paths, args.name)
+    if not backups:
+        print("No backups found.")
+        return 1
+    failures = run_batch(backups, args.output, args.workers, args.timeout, args.manifest,
+                         args.incremental)
+    print(f"\nExtracted {len(backups) - failures} of {len(backups)} backups.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
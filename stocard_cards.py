@@ -0,0 +1,189 @@
+from array import array
+
+# How each card field is stored. Strings that differ per card are packed
+# into one buffer; values many cards share are interned and stored as a
+# small code per card. Fields not listed are kept in a plain list.
+POOLED_FIELDS = ('number', 'label', 'card_id', 'content_hash')
+INTERNED_FIELDS = ('provider_ref', 'provider_id', 'logo_path')
+INDEX_FIELDS = ('snapshot_index',)
+
+# Kinds of pooled value; anything that is not a str or None is kept aside
+_STR, _NONE, _OTHER = 0, 1, 2
+
+
+class StringPool:
+    """Strings packed end to end in one UTF-8 buffer, addressed by position"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array('Q')
+        self.kinds = bytearray()
+        self.others = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, value):
+        if isinstance(value, str):
+            self.data += value.encode("utf-8", "surrogatepass")
+            self.kinds.append(_STR)
+        elif value is None:
+            self.kinds.append(_NONE)
+        else:
+            # Labels can be any JSON value
+            self.others[len(self.kinds)] = value
+            self.kinds.append(_OTHER)
+        self.ends.append(len(self.data))
+
+    def __getitem__(self, index):
+        kind = self.kinds[index]
+        if kind == _STR:
+            start = self.ends[index - 1] if index else 0
+            return self.data[start:self.ends[index]].decode("utf-8", "surrogatepass")
+        return None if kind == _NONE else self.others[index]
+
+
+class InternedColumn:
+    """One small code per card into a table of the distinct values"""
+
+    def __init__(self):
+        self.values = [None]
+        self.lookup = {None: 0}
+        self.codes = array('I')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+
+class IndexColumn:
+    """Non-negative integers, or None"""
+
+    def __init__(self):
+        self.items = array('q')
+
+    def __len__(self):
+        return len(self.items)
+
+    def append(self, value):
+        self.items.append(-1 if value is None else value)
+
+    def __getitem__(self, index):
+        value = self.items[index]
+        return None if value < 0 else value
+
+
+def _new_column(field):
+    if field in POOLED_FIELDS:
+        return StringPool()
+    if field in INTERNED_FIELDS:
+        return InternedColumn()
+    if field in INDEX_FIELDS:
+        return IndexColumn()
+    return []
+
+
+class Card:
+    """A card in a CardStore, read like the dict it was added as"""
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.store.value(self.index, key)
+
+    def get(self, key, default=None):
+        column = self.store.columns.get(key)
+        if column is None:
+            return default
+        return column[self.index]
+
+    def __contains__(self, key):
+        return key in self.store.columns
+
+    def keys(self):
+        return self.store.columns.keys()
+
+    def items(self):
+        return [(key, column[self.index]) for key, column in self.store.columns.items()]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Card({self.as_dict()!r})"
+
+
+class CardStore:
+    """Cards kept column by column rather than as one dict per card.
+
+    Card numbers, labels and IDs are packed into one UTF-8 buffer per
+    field; provider refs, provider IDs and logo paths, which every card of
+    a provider repeats, are interned and stored as a 4-byte code. Indexing
+    returns a Card, which reads like the card dict but only holds the
+    store and a position. Cards are only ever appended; reloads build a
+    new store.
+    """
+
+    def __init__(self, cards=()):
+        self.columns = {}
+        self.count = 0
+        self.extend(cards)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, card):
+        """Add a card dict (or Card); returns its index"""
+        columns = self.columns
+        for key in card.keys():
+            if key not in columns:
+                # Cards added earlier did not have this field
+                column = _new_column(key)
+                for _ in range(self.count):
+                    column.append(None)
+                columns[key] = column
+        for key, column in columns.items():
+            column.append(card.get(key))
+        self.count += 1
+        return self.count - 1
+
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def value(self, index, key):
+        return self.columns[key][index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Card(self, i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return Card(self, index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield Card(self, index)
+
+    def column(self, key):
+        """All values of one field, in card order"""
+        column = self.columns.get(key)
+        if column is None:
+            return [None] * self.count
+        return [column[index] for index in range(self.count)]
+
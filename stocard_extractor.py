@@ -1,80 +1,337 @@
-import sqlite3
 import json
 import os
+import zlib
 
-# Load the database
-conn = sqlite3.connect("sync_db")  # Replace with full path if needed
-cur = conn.cursor()
+from stocard_cards import CardStore
+from stocard_loader import (DEFAULT_CACHE_KIB, DEFAULT_MMAP_SIZE, STREAM_THRESHOLD, SyncDatabase,
+                            card_from_content, provider_id_from_ref)
+from stocard_logos import LogoStore
+from stocard_metrics import NULL_METRICS, Metrics, profiled
+from stocard_snapshot import SNAPSHOT_NAME, write_snapshot
 
-# Helper to parse JSON content
-def parse_json(blob):
+CHECKPOINT_NAME = "checkpoint.json"
+CARDS_NAME = "cards.jsonl"
+
+
+def extract_cards(db, user_id, logo_dir="logos", batch_size=500, store=None):
+    """Yield each loyalty card with 'logo_path' set, writing logos as it goes.
+
+    Cards are read in batches and each batch's new providers are resolved
+    together; only provider -> logo path is kept between batches. Logos go
+    through a LogoStore, so unchanged ones are not rewritten.
+    """
+    own_store = store is None
+    if own_store:
+        store = LogoStore(logo_dir, db.metrics)
+
+    logo_paths = {}
+    batch = []
+    try:
+        for card in db.iter_cards(user_id, batch_size):
+            batch.append(card)
+            if len(batch) >= batch_size:
+                yield from _with_logos(db, batch, logo_paths, store)
+                batch = []
+        yield from _with_logos(db, batch, logo_paths, store)
+    finally:
+        if own_store:
+            store.flush()
+
+
+def _with_logos(db, cards, logo_paths, store):
+    new_refs = {card['provider_ref'] for card in cards} - set(logo_paths) - {None}
+    images = db.provider_images(new_refs, stream_over=STREAM_THRESHOLD)
+    for card in cards:
+        ref = card['provider_ref']
+        if ref in new_refs:
+            image = images.pop(ref, None)
+            logo_paths[ref] = store.save(card['provider_id'], image) if image else None
+            new_refs.discard(ref)
+        card['logo_path'] = logo_paths.get(ref)
+        yield card
+
+
+def _fingerprint(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    elif content is None:
+        content = b""
+    return f"{len(content)}:{zlib.crc32(content):08x}"
+
+
+def _load_checkpoint(path, user_id):
     try:
-        return json.loads(blob)
-    except:
-        return None
-
-# Step 1: Find distinct_backend_id
-cur.execute("""
-    SELECT content FROM synced_resources
-    WHERE content LIKE '%distinct_backend_id%'
-""")
-user_data = cur.fetchone()
-if user_data:
-    content = parse_json(user_data[0])
-    distinct_backend_id = content.get("distinct_backend_id")
-    print("distinct_backend_id:", distinct_backend_id)
-
-    # Step 2: Get loyalty cards for this user
-    cur.execute(f"""
-        SELECT content FROM synced_resources
-        WHERE collection LIKE '/users/{distinct_backend_id}/loyalty-cards/%'
-        AND deleted = 0
-    """)
-    cards = cur.fetchall()
-
-    for card_row in cards:
-        card = parse_json(card_row[0])
-        if card is None:
+        with open(path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("user_id") == user_id:
+            return checkpoint
+    except (OSError, ValueError):
+        pass
+    return {"user_id": user_id, "cards": {}, "providers": {}}
+
+
+def extract_incremental(db, user_id, out_dir=".", batch_size=500, verify=False):
+    """Bring out_dir/cards.jsonl and out_dir/logos up to date with db.
+
+    out_dir/checkpoint.json keeps the rowid, length and fingerprint of
+    every card row and provider image from the previous run. Rows whose
+    rowid and length are the same are taken as unchanged without being
+    read; the others are read and checksummed, and only those whose
+    content changed are parsed. Cards whose rows are gone or deleted are
+    dropped, and only logos whose image changed are written again. A row
+    rewritten in place at the same size is missed; verify=True reads and
+    checksums every row and image to catch that too. Returns change counts.
+    """
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_NAME)
+    checkpoint = _load_checkpoint(checkpoint_path, user_id)
+    old_cards = checkpoint["cards"]
+    old_providers = checkpoint["providers"]
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "logos": 0}
+
+    # Step 1: Compare card rows against their rowid and length, then read the rest
+    cards = {}
+    for stamps in db.iter_card_stamps(user_id, batch_size):
+        with db.metrics.stage("fingerprint") as stage:
+            stage.count(rows=len(stamps))
+            lengths = {}
+            for rowid, collection, length in stamps:
+                entry = old_cards.get(collection)
+                if (not verify and entry and entry["rowid"] == rowid
+                        and entry.get("length") == length):
+                    cards[collection] = entry
+                    stats["unchanged"] += 1
+                else:
+                    lengths[rowid] = length
+        if not lengths:
             continue
-            
-        input_id = card.get("input_id")
-        provider_ref = card.get("input_provider_reference", {}).get("identifier")
-        label = card.get("label")
-
-        # Step 3: Get card name and image data from provider reference
-        card_name = "Unknown"
-        logo_path = None
-        if provider_ref:
-            provider_id = provider_ref.split('/')[-1] if '/' in provider_ref else provider_ref
-            
-            # Get provider logo (image)
-            cur.execute("""
-                SELECT content, content_type FROM synced_resources
-                WHERE collection LIKE ? AND content_type LIKE 'image/%' AND deleted = 0
-            """, (f"{provider_ref}%",))
-            image_row = cur.fetchone()
-            if image_row:
-                image_data, content_type = image_row
-                # Create logos directory if it doesn't exist
-                if not os.path.exists("logos"):
-                    os.makedirs("logos")
-                
-                # Determine file extension from content type
-                ext = content_type.split('/')[-1] if '/' in content_type else 'png'
-                logo_filename = f"logos/{provider_id}.{ext}"
-                
-                # Save the logo
-                with open(logo_filename, 'wb') as f:
-                    f.write(image_data)
-                logo_path = logo_filename
-
-        # Only print cards with valid input_id
-        if input_id:
-            label_display = f" - {label}" if label else ""
-            logo_display = f" [Logo: {logo_path}]" if logo_path else ""
-            print(f"Card: {card_name} - {input_id}{label_display}{logo_display}")
-
-else:
-    print("No user record with distinct_backend_id found.")
-
-print(f"\nExtracted {len([f for f in os.listdir('logos') if f.endswith('.png')])} card logos to the 'logos' directory.")
+
+        rows = db.card_rows(lengths)
+        with db.metrics.stage("fingerprint") as stage:
+            stage.count(rows=len(rows))
+            fresh = []
+            for rowid, collection, content in rows:
+                fingerprint = _fingerprint(content)
+                entry = old_cards.get(collection)
+                if entry and entry["fp"] == fingerprint:
+                    # Moved or rewritten with the same content
+                    entry["rowid"], entry["length"] = rowid, lengths[rowid]
+                    cards[collection] = entry
+                    stats["unchanged"] += 1
+                else:
+                    stats["changed" if entry else "added"] += 1
+                    fresh.append((rowid, collection, content, fingerprint))
+
+        # Rows without a card number are remembered too, so they are not re-parsed
+        with db.metrics.stage("json_parse") as stage:
+            stage.count(rows=len(fresh))
+            for rowid, collection, content, fingerprint in fresh:
+                cards[collection] = {"fp": fingerprint, "rowid": rowid, "length": lengths[rowid],
+                                     "card": card_from_content(content)}
+    stats["removed"] = len(set(old_cards) - set(cards))
+
+    # Step 2: Store again only provider images whose fingerprint moved
+    refs = {entry["card"]["provider_ref"] for entry in cards.values() if entry["card"]}
+    refs.discard(None)
+    fingerprints = db.provider_image_fingerprints(refs, checksum=verify)
+    providers = {}
+    stale = []
+    for ref in refs:
+        old = old_providers.get(ref)
+        if ref not in fingerprints:
+            providers[ref] = {"fp": None, "logo_path": None}
+        elif old and old["fp"] == fingerprints[ref]:
+            providers[ref] = old
+        else:
+            stale.append(ref)
+
+    if stale:
+        store = LogoStore(os.path.normpath(os.path.join(out_dir, "logos")), db.metrics)
+        for ref, image in db.provider_images(stale, stream_over=STREAM_THRESHOLD).items():
+            provider_id = provider_id_from_ref(ref)
+            providers[ref] = {"fp": fingerprints[ref], "logo_path": store.save(provider_id, image)}
+            stats["logos"] += 1
+        store.flush()
+
+    # Step 3: Rewrite outputs only when something changed
+    changed = (stats["added"] or stats["changed"] or stats["removed"] or stats["logos"]
+               or providers != old_providers)
+    if changed or not os.path.exists(checkpoint_path):
+        os.makedirs(out_dir, exist_ok=True)
+        lines = []
+        for entry in sorted(cards.values(), key=lambda entry: entry["rowid"]):
+            card = entry["card"]
+            if card:
+                provider = providers.get(card["provider_ref"]) or {}
+                lines.append(json.dumps(dict(card, logo_path=provider.get("logo_path"))) + "\n")
+        with db.metrics.stage("output_write") as stage:
+            stage.count(rows=len(lines))
+            stage.count(bytes_written=_write_atomic(os.path.join(out_dir, CARDS_NAME), "".join(lines)))
+            checkpoint = {"user_id": user_id, "cards": cards, "providers": providers}
+            stage.count(bytes_written=_write_atomic(checkpoint_path, json.dumps(checkpoint)))
+    return stats
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        written = f.tell()
+    os.replace(tmp, path)
+    return written
+
+
+def main(path="sync_db", incremental=False, out_dir=".", metrics_path=None, profile_path=None,
+         snapshot=False, snapshot_images=True, thumbnails=True, thumbnail_workers=None,
+         read_options=None, verify=False):
+    """Command line entry point: run extract() and print what it did"""
+    metrics = Metrics() if metrics_path else None
+    with profiled(profile_path):
+        result = extract(path, out_dir, incremental, metrics, snapshot, snapshot_images,
+                         thumbnail_workers if thumbnails else 0, read_options,
+                         on_card=_print_card, on_user=_print_user, verify=verify)
+    _print_result(result)
+    if metrics:
+        metrics.write(metrics_path)
+        print(f"Metrics written to {metrics_path}")
+    if profile_path:
+        print(f"Profile written to {profile_path} (view with: python -m pstats {profile_path})")
+
+
+def _write_snapshot(path, out_dir, user_id, cards, images, logo_dir, metrics):
+    snapshot_path = os.path.join(out_dir, SNAPSHOT_NAME)
+    with (metrics or NULL_METRICS).stage("snapshot_write") as stage:
+        count = write_snapshot(snapshot_path, user_id, cards, path, images, logo_dir)
+        stage.count(rows=count, bytes_written=os.path.getsize(snapshot_path))
+    return snapshot_path, count
+
+
+def extract(path="sync_db", out_dir=".", incremental=False, metrics=None, snapshot=False,
+            snapshot_images=True, thumbnail_workers=None, read_options=None, on_card=None,
+            on_user=None, verify=False):
+    """Extract the first user's cards and logos from a backup into out_dir.
+
+    Cards are written to out_dir/cards.jsonl, one JSON object per line,
+    and logos to out_dir/logos. This is what the command line and each
+    stocard_batch.py worker run, without the printing. on_user is
+    called with the user id once it is found, before anything is
+    extracted, and on_card with each card as it is extracted (not in
+    incremental mode). verify=True makes an incremental run checksum every
+    row and image, see extract_incremental.
+    thumbnail_workers=0 skips thumbnails; read_options are passed on to
+    SyncDatabase (immutable, mmap_size, cache_kib). Returns a dict with
+    user_id (None if the backup has no user) and what was done.
+    """
+    result = {"user_id": None, "out_dir": out_dir}
+    with SyncDatabase(path, metrics, **(read_options or {})) as db:
+        # Step 1: Find distinct_backend_id
+        users = db.user_ids()
+        if not users:
+            return result
+        user_id = result["user_id"] = users[0]
+        if on_user:
+            on_user(user_id)
+        logo_dir = os.path.normpath(os.path.join(out_dir, "logos"))
+
+        cards = CardStore()
+        if incremental:
+            result["incremental"] = extract_incremental(db, user_id, out_dir, verify=verify)
+            # Opened afterwards, so it sees the logos extract_incremental stored
+            store = LogoStore(logo_dir, metrics)
+            if snapshot:
+                with open(os.path.join(out_dir, CARDS_NAME), encoding="utf-8") as f:
+                    cards.extend(json.loads(line) for line in f)
+        else:
+            # Step 2: Get loyalty cards for this user, with their logos
+            store = LogoStore(logo_dir, metrics)
+            os.makedirs(out_dir, exist_ok=True)
+            cards_path = os.path.join(out_dir, CARDS_NAME)
+            count = 0
+            with open(f"{cards_path}.tmp", "w", encoding="utf-8") as f:
+                for card in extract_cards(db, user_id, store=store):
+                    f.write(json.dumps(card) + "\n")
+                    count += 1
+                    if snapshot:
+                        cards.append(card)
+                    if on_card:
+                        on_card(card)
+                db.metrics.count("output_write", rows=count, bytes_written=f.tell())
+            os.replace(f"{cards_path}.tmp", cards_path)
+            result["cards"] = count
+            result["logos"] = len(store)
+            result["written"] = store.written
+
+    # Step 3: Thumbnails at the viewers' sizes, and the snapshot they can open
+    result["logo_dir"] = store.logo_dir
+    if thumbnail_workers != 0:
+        result["thumbnails"] = store.make_thumbnails(workers=thumbnail_workers)
+    store.flush()
+    if snapshot:
+        result["snapshot"], result["snapshot_cards"] = _write_snapshot(
+            path, out_dir, user_id, cards, snapshot_images, store.logo_dir, metrics)
+    return result
+
+
+def _print_user(user_id):
+    print("distinct_backend_id:", user_id)
+
+
+def _print_card(card):
+    card_name = "Unknown"
+    label_display = f" - {card['label']}" if card['label'] else ""
+    logo_display = f" [Logo: {card['logo_path']}]" if card['logo_path'] else ""
+    print(f"Card: {card_name} - {card['number']}{label_display}{logo_display}")
+
+
+def _print_result(result):
+    if result["user_id"] is None:
+        print("No user record with distinct_backend_id found.")
+        return
+    if "incremental" in result:
+        stats = result["incremental"]
+        print(f"Cards: {stats['added']} added, {stats['changed']} changed, "
+              f"{stats['removed']} removed, {stats['unchanged']} unchanged; "
+              f"{stats['logos']} logos updated in '{result['out_dir']}'.")
+    else:
+        print(f"\nExtracted {result['logos']} card logos to the '{result['logo_dir']}' directory "
+              f"({result['written']} new images stored).")
+    if result.get("thumbnails"):
+        print(f"Rendered {result['thumbnails']} logo thumbnails into '{result['logo_dir']}/thumbs'.")
+    if "snapshot" in result:
+        print(f"Snapshot of {result['snapshot_cards']} cards written to '{result['snapshot']}'.")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract loyalty cards and logos from a Stocard sync_db")
+    parser.add_argument("database", nargs="?", default="sync_db", help="path to the sync_db backup")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process rows changed since the last run's checkpoint")
+    parser.add_argument("--verify", action="store_true",
+                        help="with --incremental, checksum every row and logo instead of trusting "
+                             "unchanged rowids and lengths")
+    parser.add_argument("--output", default=".", help="directory for logos/ and cards.jsonl (and checkpoint.json)")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="write time, rows and bytes per stage to PATH as JSON")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="run under cProfile and write pstats data to PATH")
+    parser.add_argument("--snapshot", action="store_true",
+                        help=f"also write OUTPUT/{SNAPSHOT_NAME}, which the viewers open instead of sync_db")
+    parser.add_argument("--snapshot-no-images", action="store_true",
+                        help="leave logo thumbnails and barcodes out of the snapshot")
+    parser.add_argument("--no-thumbnails", action="store_true",
+                        help="do not pre-render logo thumbnails at the viewers' sizes")
+    parser.add_argument("--thumbnail-workers", type=int, default=None,
+                        help="processes rendering thumbnails (default: CPU count)")
+    parser.add_argument("--mmap-mb", type=int, default=DEFAULT_MMAP_SIZE // 2**20,
+                        help="MiB of the backup SQLite may memory-map (0 turns mmap off)")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_KIB // 1024,
+                        help="MiB of SQLite page cache")
+    parser.add_argument("--not-immutable", action="store_true",
+                        help="lock the backup while reading, for a file that may change during the run")
+    args = parser.parse_args()
+    read_options = {"mmap_size": args.mmap_mb * 2**20, "cache_kib": args.cache_mb * 1024}
+    if args.not_immutable:
+        read_options["immutable"] = False
+    main(args.database, args.incremental, args.output, args.metrics, args.profile,
+         args.snapshot, not args.snapshot_no_images, not args.no_thumbnails, args.thumbnail_workers,
+         read_options, args.verify)
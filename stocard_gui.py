@@ -1,19 +1,184 @@
-import sqlite3
-import json
 import os
 import tkinter as tk
-from tkinter import ttk, scrolledtext
-from PIL import Image, ImageTk
-import barcode
-from barcode.writer import ImageWriter
-from io import BytesIO
-import tempfile
+from tkinter import ttk
+
+from stocard_background import BackgroundLoader
+from stocard_barcode import BarcodeCache
+from stocard_cards import CardStore
+from stocard_logos import LogoManifest
+from stocard_metrics import Metrics, NULL_METRICS
+from stocard_search import CardSearchIndex
+from stocard_snapshot import SNAPSHOT_NAME, open_snapshot
+from stocard_watch import DEFAULT_INTERVAL_MS, BackupWatcher, is_unchanged
+
+# The card list is virtual: every card gets a fixed-height slot on the
+# canvas, but widgets only exist for slots in or near the viewport. The
+# slot height is measured from a rendered card, see measure_card_height
+CARD_GAP = 20
+HEADER_HEIGHT = 80
+FOOTER_HEIGHT = 60
+OVERSCAN = 2
+LOGO_SIZE = (80, 80)
+BARCODE_SIZE = (350, 80)
+
+
+def visible_card_range(top, bottom, count, card_height):
+    """Return (first, last) card indexes, last exclusive, for a viewport"""
+    first = int((top - HEADER_HEIGHT) // card_height) - OVERSCAN
+    last = int((bottom - HEADER_HEIGHT) // card_height) + 1 + OVERSCAN
+    return max(first, 0), min(max(last, 0), count)
+
+
+class CardWidget:
+    """Widgets for one card slot, rebound to another card when recycled"""
+    
+    def __init__(self, parent):
+        # Create main card frame with border
+        self.frame = ttk.LabelFrame(parent, padding=15)
+        
+        # Top section: Logo and card info
+        top_frame = ttk.Frame(self.frame)
+        top_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        # Logo section (left)
+        logo_frame = ttk.Frame(top_frame)
+        logo_frame.pack(side=tk.LEFT, padx=(0, 20))
+        
+        ttk.Label(logo_frame, text="Logo:", font=("Arial", 9, "bold")).pack()
+        self.logo_label = ttk.Label(logo_frame, anchor="center")
+        self.logo_label.pack()
+        
+        # Card info section (right)
+        info_frame = ttk.Frame(top_frame)
+        info_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # Card label (packed only when the card has one)
+        self.label_caption = ttk.Label(info_frame, text="Label:", font=("Arial", 10, "bold"))
+        self.label_entry = ttk.Entry(info_frame, font=("Arial", 12, "bold"))
+        
+        # Card number
+        self.number_caption = ttk.Label(info_frame, text="Card Number:", font=("Arial", 10, "bold"))
+        self.number_caption.pack(anchor=tk.W)
+        card_num_frame = ttk.Frame(info_frame)
+        card_num_frame.pack(fill=tk.X, pady=(0, 5))
+        
+        self.number_entry = ttk.Entry(card_num_frame, font=("Courier", 12))
+        self.number_entry.pack(fill=tk.X)
+        
+        # Code 128 Barcode section
+        barcode_frame = ttk.LabelFrame(self.frame, text="Code 128 Barcode", padding=10)
+        barcode_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        self.barcode_label = ttk.Label(barcode_frame)
+        self.barcode_label.pack()
+        
+        # Instructions
+        self.hint_label = ttk.Label(barcode_frame, text="Scan with any barcode scanner app",
+                                    font=("Arial", 9), foreground="gray")
+        
+        self.window = None
+        self.index = None
+        self.card = None
+    
+    def _set_entry(self, entry, text):
+        entry.config(state="normal")
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+        entry.config(state="readonly")
+    
+    def _title(self, index, card):
+        card_title = f"Card #{index + 1}"
+        if card['label']:
+            card_title += f' - "{card["label"]}"'
+        return card_title
+    
+    def show(self, index, card):
+        """Fill the widgets with a card; images follow via set_images"""
+        self.index = index
+        self.card = card
+        self.frame.config(text=self._title(index, card))
+        
+        self.logo_label.config(image="", text="Loading...", background="", width=12)
+        self.logo_label.image = None
+        
+        if card['label']:
+            self.label_caption.pack(anchor=tk.W, before=self.number_caption)
+            self.label_entry.pack(fill=tk.X, pady=(0, 10), before=self.number_caption)
+            self._set_entry(self.label_entry, card['label'])
+        else:
+            self.label_caption.pack_forget()
+            self.label_entry.pack_forget()
+        
+        self._set_entry(self.number_entry, card['number'])
+        
+        self.barcode_label.config(image="", text="Generating barcode...")
+        self.barcode_label.image = None
+        self.hint_label.pack_forget()
+    
+    def set_images(self, card, logo_img, barcode_img):
+        if logo_img:
+            self.logo_label.config(image=logo_img, text="", background="", width="")
+        else:
+            # Placeholder for missing logo
+            self.logo_label.config(image="", text="No Logo\nAvailable",
+                                   background="lightgray", width=12)
+        self.logo_label.image = logo_img  # Keep a reference
+        
+        if barcode_img:
+            self.barcode_label.config(image=barcode_img, text="")
+            self.hint_label.pack(pady=(5, 0))
+        else:
+            self.barcode_label.config(image="", text=f"Could not generate barcode for: {card['number']}")
+            self.hint_label.pack_forget()
+        self.barcode_label.image = barcode_img  # Keep a reference
+    
+    def renumber(self, index):
+        """Move the card shown to another list position, keeping its images.
+        
+        self.card still reads from the list it was bound from, whose entry
+        for this card is the same.
+        """
+        self.index = index
+        self.frame.config(text=self._title(index, self.card))
+    
+    def clear(self):
+        """Drop image references so recycled slots do not pin memory"""
+        self.index = None
+        self.card = None
+        self.logo_label.config(image="")
+        self.logo_label.image = None
+        self.barcode_label.config(image="")
+        self.barcode_label.image = None
 
 class StocardGUI:
-    def __init__(self, root):
+    def __init__(self, root, metrics=None, snapshot=None, watch_ms=None):
         self.root = root
+        self.metrics = metrics or NULL_METRICS
+        self.snapshot = snapshot
         self.root.title("Stocard Extractor - Card Viewer")
         self.root.geometry("1200x800")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Loading progress, shown until every card has arrived
+        self.status_frame = ttk.Frame(root)
+        self.status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 10))
+        self.status_label = ttk.Label(self.status_frame, text="Loading cards...")
+        self.status_label.pack(side=tk.LEFT)
+        self.progress = ttk.Progressbar(self.status_frame, mode="determinate", length=300)
+        self.progress.pack(side=tk.RIGHT)
+        
+        # Search box, filters the list on every keystroke
+        self.search_frame = ttk.Frame(root)
+        self.search_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=(10, 0))
+        ttk.Label(self.search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(self.search_frame, textvariable=self.search_var, width=40)
+        self.search_entry.pack(side=tk.LEFT, padx=(5, 10))
+        self.search_entry.bind("<Escape>", lambda event: self.search_var.set(""))
+        self.search_status = ttk.Label(self.search_frame, text="", foreground="gray")
+        self.search_status.pack(side=tk.LEFT)
+        self.search_var.trace_add("write", lambda *args: self.apply_search())
+        self.root.bind("<Control-f>", lambda event: self.search_entry.focus_set())
         
         # Create main frame with scrollbar
         self.main_frame = ttk.Frame(root)
@@ -22,209 +187,402 @@ class StocardGUI:
         # Create canvas and scrollbar for scrolling
         self.canvas = tk.Canvas(self.main_frame)
         self.scrollbar = ttk.Scrollbar(self.main_frame, orient="vertical", command=self.canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.canvas)
-        
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        )
-        
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.configure(yscrollcommand=self._on_yscroll)
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
         
         self.canvas.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="right", fill="y")
         
         # Bind mousewheel to canvas
         self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
+        self.card_height = self.measure_card_height()
+        
+        # Rendered barcodes, kept while they are scrolled back and forth
+        self.barcodes = BarcodeCache()
+        self.logo_images = {}
+        
+        # Card data, and the widgets currently bound to visible slots.
+        # view lists the indexes of the cards matching the search (None: all)
+        self.cards = CardStore()
+        self.search = CardSearchIndex()
+        self.view = None
+        self.visible_widgets = {}
+        self.free_widgets = []
+        self.fixed_windows = []
+        self.footer_window = None
+        self.footer_label = None
+        self.user_label = None
+        self.no_user_window = None
+        
+        # SQLite and PIL work runs in the background, results arrive via after()
+        self.loader = BackgroundLoader(root, metrics=self.metrics)
+        
+        # Logo paths come from the extractor's index, thumbnails preferred
+        self.logos = LogoManifest("logos")
+        
+        # Watch mode: reload sync_db when it changes and rebind only the slots that differ
+        self.watcher = None
+        if watch_ms:
+            self.watcher = BackupWatcher(root, self.loader, "sync_db", self.prepare_card,
+                                         lambda: self.cards, self.on_cards_reloaded,
+                                         on_start=self.on_reload_start, interval_ms=watch_ms)
         
         # Load and display cards
         self.load_cards()
     
+    def measure_card_height(self):
+        """Slot height: the tallest card layout (label, logo, barcode) as Tk renders it here.
+        
+        Fonts, DPI scaling and the theme change how tall a card is, so a
+        throwaway CardWidget is laid out and measured instead of guessed.
+        """
+        probe = CardWidget(self.canvas)
+        card = {'number': "0", 'label': "Label"}
+        probe.show(0, card)
+        probe.set_images(card, tk.PhotoImage(width=LOGO_SIZE[0], height=LOGO_SIZE[1]),
+                         tk.PhotoImage(width=BARCODE_SIZE[0], height=BARCODE_SIZE[1]))
+        probe.frame.update_idletasks()
+        height = probe.frame.winfo_reqheight()
+        probe.frame.destroy()
+        return height + CARD_GAP
+    
+    def on_close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        self.loader.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.root.destroy()
+    
     def _on_mousewheel(self, event):
         self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
     
-    def parse_json(self, blob):
-        try:
-            return json.loads(blob)
-        except:
-            return None
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.update_visible_cards()
     
-    def generate_barcode(self, card_number, card_id):
-        """Generate Code 128 barcode image for card number"""
+    def _on_canvas_configure(self, event):
+        # Stretch every slot to the canvas width
+        for window in self.fixed_windows:
+            self.canvas.itemconfigure(window, width=event.width - 10)
+        for widget in self.visible_widgets.values():
+            self.canvas.itemconfigure(widget.window, width=event.width - 10)
+        for widget in self.free_widgets:
+            self.canvas.itemconfigure(widget.window, width=event.width - 10)
+        self.update_visible_cards()
+    
+    def generate_barcode(self, card_number, card_id, snapshot_index=None):
+        """Generate Code 128 barcode image for card number (worker thread)"""
         try:
-            # Use Code128 barcode format
-            code128 = barcode.get('code128', str(card_number), writer=ImageWriter())
-            
-            # Generate barcode in memory
-            buffer = BytesIO()
-            code128.write(buffer)
-            buffer.seek(0)
-            
-            # Load and resize the barcode image
-            barcode_img = Image.open(buffer)
-            barcode_img = barcode_img.resize((350, 80), Image.Resampling.LANCZOS)
-            
-            return ImageTk.PhotoImage(barcode_img)
+            if snapshot_index is not None:
+                # Module pattern embedded in the snapshot, only needs rasterizing
+                barcode_img = self.snapshot.barcode_image(snapshot_index, BARCODE_SIZE)
+                if barcode_img is not None:
+                    return barcode_img
+            # Rendered once, then reused from the in-memory barcode cache
+            return self.barcodes.get(card_number, BARCODE_SIZE)
         except Exception as e:
             print(f"Error generating Code 128 barcode for {card_number}: {e}")
             return None
     
-    def load_logo(self, logo_path):
-        """Load and resize logo image"""
+    def logo_key(self, logo_path):
+        """Cache key of a logo file: a logo replaced at the same path gets a new one"""
+        try:
+            st = os.stat(logo_path)
+            return (logo_path, st.st_mtime_ns, st.st_size)
+        except (OSError, TypeError):
+            return (logo_path, None, None)
+    
+    def load_logo(self, logo_path, snapshot_index=None):
+        """Load and resize logo image (worker thread)"""
+        # PIL is first imported here, off the Tk thread, so the window opens sooner
+        from PIL import Image
+        
+        logo_img = None
         try:
-            if logo_path and os.path.exists(logo_path):
-                logo_img = Image.open(logo_path)
-                # Resize logo to reasonable size
-                logo_img = logo_img.resize((80, 80), Image.Resampling.LANCZOS)
-                return ImageTk.PhotoImage(logo_img)
+            if snapshot_index is not None:
+                logo_img = self.snapshot.logo_image(snapshot_index)
+            if logo_img is None and logo_path and os.path.exists(logo_path):
+                # Decoded here, not by PhotoImage on the Tk thread, and the file closed
+                with Image.open(logo_path) as logo_img:
+                    logo_img.load()
+            if logo_img is not None and logo_img.size != LOGO_SIZE:
+                # Resize logo to reasonable size (pre-made thumbnails already are)
+                logo_img = logo_img.resize(LOGO_SIZE, Image.Resampling.LANCZOS)
         except Exception as e:
             print(f"Error loading logo {logo_path}: {e}")
-        return None
+        return logo_img
+    
+    def prepare_images(self, card, index):
+        """(logo key, logo, barcode) for a card (worker thread).
+        
+        Logos are resized once per provider and shared by all its cards;
+        the cache is only read here and filled on the Tk thread.
+        """
+        with self.metrics.stage("card_images_prepare") as stage:
+            stage.count(rows=1)
+            snapshot_index = card.get('snapshot_index')
+            logo_key = self.logo_key(card['logo_path'])
+            cache = self.logo_images  # Replaced, never emptied, on reload
+            if logo_key in cache:
+                logo_img = cache[logo_key]
+            else:
+                logo_img = self.load_logo(card['logo_path'], snapshot_index)
+            return (logo_key, logo_img,
+                    self.generate_barcode(card['number'], index, snapshot_index))
     
     def load_cards(self):
-        # Connect to database
-        conn = sqlite3.connect("sync_db")
-        cur = conn.cursor()
-        
-        # Find distinct_backend_id
-        cur.execute("""
-            SELECT content FROM synced_resources
-            WHERE content LIKE '%distinct_backend_id%'
-        """)
-        user_data = cur.fetchone()
-        
-        if not user_data:
-            ttk.Label(self.scrollable_frame, text="No user record with distinct_backend_id found.", 
-                     font=("Arial", 12)).pack(pady=20)
+        """Start streaming cards from the snapshot if there is one, else the database"""
+        if self.snapshot is not None:
+            self.loader.load_snapshot(self.snapshot, None, self.on_user_loaded,
+                                      self.on_cards_loaded, self.on_load_done)
             return
+        self.loader.load_cards("sync_db", self.prepare_card, self.on_user_loaded,
+                               self.on_cards_loaded, self.on_load_done, with_ids=self.watcher is not None)
+    
+    def snapshot_note(self):
+        """Status suffix warning when the snapshot is older than ./sync_db"""
+        if self.snapshot is not None and self.snapshot.is_stale("sync_db"):
+            return " from an out of date snapshot (re-run stocard_extractor.py --snapshot)"
+        return ""
+    
+    def prepare_card(self, card):
+        """Keep only what is displayed (reader thread)"""
+        # Get logo path
+        logo_path = self.logos.display_path(card['provider_id'], LOGO_SIZE)
         
-        content = self.parse_json(user_data[0])
-        distinct_backend_id = content.get("distinct_backend_id")
+        return {
+            'number': card['number'],
+            'label': card['label'],
+            'provider_id': card['provider_id'],
+            'logo_path': logo_path
+        }
+    
+    def on_user_loaded(self, distinct_backend_id, total):
+        if not distinct_backend_id:
+            message = ttk.Label(self.canvas, text="No user record with distinct_backend_id found.", 
+                               font=("Arial", 12))
+            self.no_user_window = self.canvas.create_window((0, 20), window=message, anchor="nw")
+            self.fixed_windows.append(self.no_user_window)
+            return
         
         # Add header
-        header_frame = ttk.Frame(self.scrollable_frame)
-        header_frame.pack(fill=tk.X, pady=(0, 20))
-        
+        header_frame = ttk.Frame(self.canvas)
         ttk.Label(header_frame, text="Stocard Loyalty Cards", 
                  font=("Arial", 16, "bold")).pack()
-        ttk.Label(header_frame, text=f"User ID: {distinct_backend_id}", 
-                 font=("Arial", 10)).pack()
-        
-        # Get loyalty cards
-        cur.execute(f"""
-            SELECT content FROM synced_resources
-            WHERE collection LIKE '/users/{distinct_backend_id}/loyalty-cards/%'
-            AND deleted = 0
-        """)
-        cards = cur.fetchall()
-        
-        card_count = 0
-        for card_row in cards:
-            card = self.parse_json(card_row[0])
-            if card is None:
-                continue
-                
-            input_id = card.get("input_id")
-            if not input_id:
-                continue
-                
-            provider_ref = card.get("input_provider_reference", {}).get("identifier")
-            label = card.get("label")
-            
-            # Get logo path
-            logo_path = None
-            if provider_ref:
-                provider_id = provider_ref.split('/')[-1] if '/' in provider_ref else provider_ref
-                potential_logo = f"logos/{provider_id}.png"
-                if os.path.exists(potential_logo):
-                    logo_path = potential_logo
-            
-            # Create card display
-            self.create_card_widget(input_id, label, logo_path, card_count)
-            card_count += 1
-        
-        # Footer
-        footer_frame = ttk.Frame(self.scrollable_frame)
-        footer_frame.pack(fill=tk.X, pady=(20, 0))
-        ttk.Label(footer_frame, text=f"Total cards: {card_count}", 
-                 font=("Arial", 12, "bold")).pack()
-        
-        conn.close()
-    
-    def create_card_widget(self, card_number, label, logo_path, index):
-        # Create main card frame with border
-        card_title = f"Card #{index + 1}"
-        if label:
-            card_title += f' - "{label}"'
-        
-        card_frame = ttk.LabelFrame(self.scrollable_frame, text=card_title, padding=15)
-        card_frame.pack(fill=tk.X, pady=10, padx=5)
+        self.user_label = ttk.Label(header_frame, text=f"User ID: {distinct_backend_id}", 
+                                    font=("Arial", 10))
+        self.user_label.pack()
+        self.fixed_windows.append(self.canvas.create_window((5, 0), window=header_frame, anchor="nw"))
         
-        # Top section: Logo and card info
-        top_frame = ttk.Frame(card_frame)
-        top_frame.pack(fill=tk.X, pady=(0, 10))
+        # Footer, moved down as cards arrive
+        footer_frame = ttk.Frame(self.canvas)
+        self.footer_label = ttk.Label(footer_frame, text="Total cards: 0", 
+                                      font=("Arial", 12, "bold"))
+        self.footer_label.pack(pady=(20, 0))
+        self.footer_window = self.canvas.create_window((5, HEADER_HEIGHT), window=footer_frame, anchor="nw")
+        self.fixed_windows.append(self.footer_window)
         
-        # Logo section (left)
-        logo_frame = ttk.Frame(top_frame)
-        logo_frame.pack(side=tk.LEFT, padx=(0, 20))
+        self.progress.config(maximum=max(total, 1))
+    
+    def on_cards_loaded(self, cards):
+        """Add a batch of cards to the virtual list"""
+        with self.metrics.stage("card_batch") as stage:
+            stage.count(rows=len(cards))
+            self.add_cards(cards)
+    
+    def add_cards(self, cards):
+        self.cards.extend(cards)
+        for card in cards:
+            index = self.search.add(card)
+            if self.view is not None and self.search.matches(index, self.search_var.get()):
+                self.view.append(index)
+        self.layout_cards()
         
-        ttk.Label(logo_frame, text="Logo:", font=("Arial", 9, "bold")).pack()
+        self.progress.config(value=len(self.cards))
+        self.status_label.config(text=f"Loading cards... {len(self.cards)}")
+        self.update_visible_cards()
+    
+    def view_size(self):
+        return len(self.cards) if self.view is None else len(self.view)
+    
+    def layout_cards(self):
+        """Size the scroll region and move the footer for the cards shown"""
+        if self.footer_window is None:
+            return
+        footer_top = HEADER_HEIGHT + self.view_size() * self.card_height
+        self.canvas.coords(self.footer_window, 5, footer_top)
+        if self.view is None:
+            self.footer_label.config(text=f"Total cards: {len(self.cards)}")
+            self.search_status.config(text="")
+        else:
+            self.footer_label.config(text=f"Showing {len(self.view)} of {len(self.cards)} cards")
+            self.search_status.config(text=f"{len(self.view)} matching")
+        self.canvas.configure(scrollregion=(0, 0, 0, footer_top + FOOTER_HEIGHT))
+    
+    def apply_search(self):
+        """Filter the list to the cards matching the search box"""
+        with self.metrics.stage("search") as stage:
+            self.view = self.search.search(self.search_var.get())
+            stage.count(rows=self.view_size())
         
-        logo_img = self.load_logo(logo_path)
-        if logo_img:
-            logo_label = ttk.Label(logo_frame, image=logo_img)
-            logo_label.image = logo_img  # Keep a reference
-            logo_label.pack()
+        # Only the handful of bound slots are rebound, no widget is rebuilt
+        for widget in self.visible_widgets.values():
+            widget.clear()
+            self.canvas.itemconfigure(widget.window, state="hidden")
+            self.free_widgets.append(widget)
+        self.visible_widgets.clear()
+        self.layout_cards()
+        self.canvas.yview_moveto(0)
+        self.update_visible_cards()
+    
+    def on_load_done(self, error):
+        self.progress.pack_forget()
+        if error:
+            self.status_label.config(text=f"Error loading cards: {error}", foreground="red")
         else:
-            # Placeholder for missing logo
-            placeholder = ttk.Label(logo_frame, text="No Logo\nAvailable", 
-                                  background="lightgray", width=12, anchor="center")
-            placeholder.pack()
+            self.status_label.config(text=f"Loaded {len(self.cards)} cards{self.snapshot_note()}")
+        if self.watcher is not None:
+            self.watcher.ready()
+    
+    def on_reload_start(self):
+        # Logos extracted since the last load get picked up too
+        self.logos = LogoManifest("logos")
+        self.logo_images = {}
+        self.status_label.config(text="sync_db changed, reloading...", foreground="")
+    
+    def on_cards_reloaded(self, reload, error):
+        """Patch the list with a reloaded card list (Tk thread)"""
+        if error:
+            self.status_label.config(text=f"Error reloading cards: {error}", foreground="red")
+            return
+        if reload.user_id and self.footer_window is None:
+            # The backup had no user before; set up the header now
+            if self.no_user_window is not None:
+                self.canvas.delete(self.no_user_window)
+                self.fixed_windows.remove(self.no_user_window)
+                self.no_user_window = None
+            self.on_user_loaded(reload.user_id, len(reload.cards))
+        elif reload.user_id and self.user_label is not None:
+            self.user_label.config(text=f"User ID: {reload.user_id}")
         
-        # Card info section (right)
-        info_frame = ttk.Frame(top_frame)
-        info_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        diff = reload.diff
+        with self.metrics.stage("reload_apply") as stage:
+            stage.count(rows=len(diff.changed) + len(diff.added) + len(diff.removed))
+            if not is_unchanged(diff):
+                self.patch_cards(reload.cards, diff)
+        self.status_label.config(
+            text=f"Reloaded {len(self.cards)} cards: {len(diff.added)} added, "
+                 f"{len(diff.changed)} changed, {len(diff.removed)} removed", foreground="")
+    
+    def patch_cards(self, cards, diff):
+        """Swap in a reloaded card list, rebinding only slots whose card differs"""
+        self.cards = cards
+        self.search = CardSearchIndex()
+        for card in cards:
+            self.search.add(card)
+        self.view = self.search.search(self.search_var.get())
+        self.layout_cards()
         
-        # Card label (if available)
-        if label:
-            ttk.Label(info_frame, text="Label:", font=("Arial", 10, "bold")).pack(anchor=tk.W)
-            label_entry = ttk.Entry(info_frame, font=("Arial", 12, "bold"))
-            label_entry.insert(0, label)
-            label_entry.config(state="readonly")
-            label_entry.pack(fill=tk.X, pady=(0, 10))
+        # Bound widgets of unchanged cards follow them to their new slot, keeping their images
+        by_card = {widget.index: widget for widget in self.visible_widgets.values()}
+        self.visible_widgets = {}
+        top = self.canvas.canvasy(0)
+        first, last = visible_card_range(top, top + self.canvas.winfo_height(), self.view_size(), self.card_height)
+        for slot in range(first, last):
+            index = slot if self.view is None else self.view[slot]
+            old = diff.kept[index]
+            widget = by_card.pop(old, None) if old is not None else None
+            if widget is not None:
+                if widget.index != index:
+                    widget.renumber(index)
+                self.canvas.coords(widget.window, 5, HEADER_HEIGHT + slot * self.card_height + CARD_GAP // 2)
+                self.visible_widgets[slot] = widget
+        for widget in by_card.values():
+            widget.clear()
+            self.canvas.itemconfigure(widget.window, state="hidden")
+            self.free_widgets.append(widget)
+        self.update_visible_cards()
+    
+    def update_visible_cards(self):
+        """Bind widgets to the cards in and near the viewport, recycling the rest"""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first, last = visible_card_range(top, bottom, self.view_size(), self.card_height)
         
-        # Card number
-        ttk.Label(info_frame, text="Card Number:", font=("Arial", 10, "bold")).pack(anchor=tk.W)
-        card_num_frame = ttk.Frame(info_frame)
-        card_num_frame.pack(fill=tk.X, pady=(0, 5))
+        # Release widgets that scrolled out of range
+        for slot in list(self.visible_widgets):
+            if not first <= slot < last:
+                widget = self.visible_widgets.pop(slot)
+                widget.clear()
+                self.canvas.itemconfigure(widget.window, state="hidden")
+                self.free_widgets.append(widget)
         
-        card_num_entry = ttk.Entry(card_num_frame, font=("Courier", 12))
-        card_num_entry.insert(0, str(card_number))
-        card_num_entry.config(state="readonly")
-        card_num_entry.pack(fill=tk.X)
+        for slot in range(first, last):
+            if slot not in self.visible_widgets:
+                widget = self.free_widgets.pop() if self.free_widgets else self.create_card_widget()
+                self.visible_widgets[slot] = widget
+                self.bind_card_widget(widget, slot)
+    
+    def create_card_widget(self):
+        """Create an empty card slot on the canvas"""
+        widget = CardWidget(self.canvas)
+        widget.window = self.canvas.create_window(
+            (5, 0), window=widget.frame, anchor="nw",
+            width=max(self.canvas.winfo_width() - 10, 1), height=self.card_height - CARD_GAP
+        )
+        return widget
+    
+    def bind_card_widget(self, widget, slot):
+        """Show the card in list slot `slot`; its images are prepared in the background"""
+        with self.metrics.stage("card_widget_bind") as stage:
+            stage.count(rows=1)
+            self.show_card(widget, slot)
+    
+    def show_card(self, widget, slot):
+        index = slot if self.view is None else self.view[slot]
+        card = self.cards[index]
+        widget.show(index, card)
+        self.loader.submit(self.prepare_images, card, index,
+                           callback=lambda images: self.apply_card_images(widget, card, images))
         
-        # Code 128 Barcode section
-        barcode_frame = ttk.LabelFrame(card_frame, text="Code 128 Barcode", padding=10)
-        barcode_frame.pack(fill=tk.X, pady=(10, 0))
+        self.canvas.coords(widget.window, 5, HEADER_HEIGHT + slot * self.card_height + CARD_GAP // 2)
+        self.canvas.itemconfigure(widget.window, state="normal")
+    
+    def apply_card_images(self, widget, card, images):
+        """Turn prepared images into PhotoImages (Tk thread)"""
+        from PIL import ImageTk
         
-        # Generate and display barcode
-        barcode_img = self.generate_barcode(str(card_number), index)
-        if barcode_img:
-            barcode_label = ttk.Label(barcode_frame, image=barcode_img)
-            barcode_label.image = barcode_img  # Keep a reference
-            barcode_label.pack()
-            
-            # Instructions
-            ttk.Label(barcode_frame, text="Scan with any barcode scanner app", 
-                     font=("Arial", 9), foreground="gray").pack(pady=(5, 0))
-        else:
-            ttk.Label(barcode_frame, text=f"Could not generate barcode for: {card_number}").pack()
+        logo_key, logo_img, barcode_img = images or (None, None, None)
+        if logo_key is not None:
+            self.logo_images[logo_key] = logo_img
+        if widget.card is not card:
+            return  # Recycled for another card meanwhile
+        with self.metrics.stage("card_images_apply") as stage:
+            stage.count(rows=1)
+            widget.set_images(
+                card,
+                ImageTk.PhotoImage(logo_img) if logo_img else None,
+                ImageTk.PhotoImage(barcode_img) if barcode_img else None,
+            )
 
-def main():
+def main(metrics_path=None, snapshot_path=None, watch_ms=None):
     root = tk.Tk()
-    app = StocardGUI(root)
+    metrics = Metrics() if metrics_path else None
+    app = StocardGUI(root, metrics, open_snapshot(snapshot_path), watch_ms)
     root.mainloop()
+    if metrics:
+        metrics.write(metrics_path)
+        print(f"Metrics written to {metrics_path}")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="View the loyalty cards in ./sync_db")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="on exit, write per-stage timings (e.g. per-card widget build) to PATH as JSON")
+    parser.add_argument("--snapshot", default=None, metavar="PATH",
+                        help=f"read cards from this snapshot instead of sync_db (default: ./{SNAPSHOT_NAME} if present)")
+    parser.add_argument("--watch", nargs="?", type=float, const=DEFAULT_INTERVAL_MS / 1000, default=None,
+                        metavar="SECONDS", help="reload sync_db when it changes, checking every SECONDS (default: 1)")
+    args = parser.parse_args()
+    main(args.metrics, args.snapshot, int(args.watch * 1000) if args.watch else None)
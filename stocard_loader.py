@@ -0,0 +1,534 @@
+import os
+import sqlite3
+import json
+import zlib
+from collections import namedtuple
+
+from stocard_cards import CardStore
+from stocard_metrics import NULL_METRICS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Everything a viewer or the extractor needs from one backup
+LoadResult = namedtuple("LoadResult", ["users", "cards", "images"])
+
+# Read tuning: map up to this many bytes of the backup instead of copying
+# pages through read(), and a page cache of this many KiB per connection
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_KIB = 16 * 1024
+
+# Image BLOBs longer than this are streamed to disk in chunks of BLOB_CHUNK_SIZE
+STREAM_THRESHOLD = 1024 * 1024
+BLOB_CHUNK_SIZE = 256 * 1024
+
+# Project the three card fields with SQLite's JSON1 functions, as a JSON
+# array [input_id, label, identifier]; rows without an input_id never leave
+# SQLite. json_valid guards every other call. Documents JSON1 rejects are
+# returned whole (second column) for Python to judge, so the cards come out
+# the same as parsing every row in Python. The third column is the card's
+# collection path.
+CARD_FIELDS_SQL = """
+    SELECT fields, CASE WHEN fields IS NULL THEN doc END, collection
+    FROM (
+        SELECT rowid, doc, collection,
+               CASE WHEN json_valid(doc) THEN json_extract(
+                   doc, '$.input_id', '$.label', '$.input_provider_reference.identifier'
+               ) END AS fields,
+               CASE WHEN json_valid(doc) THEN json_type(doc, '$.input_id') END AS id_type
+        FROM (
+            SELECT rowid, collection, CAST(content AS TEXT) AS doc FROM synced_resources
+            WHERE rowid IN ({placeholders})
+        )
+    )
+    WHERE (fields IS NULL AND doc IS NOT NULL) OR id_type <> 'null'
+    ORDER BY rowid
+"""
+
+
+def parse_json(blob):
+    if orjson is not None:
+        try:
+            return orjson.loads(blob)
+        except orjson.JSONDecodeError:
+            pass  # Let json decide; it also accepts NaN and Infinity
+    try:
+        return json.loads(blob)
+    except:
+        return None
+
+
+def prefix_upper_bound(prefix):
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def provider_id_from_ref(provider_ref):
+    return provider_ref.split('/')[-1] if '/' in provider_ref else provider_ref
+
+
+def card_from_content(content):
+    """Return the card fields the tools use, or None for unusable rows"""
+    card = parse_json(content)
+    if not isinstance(card, dict):
+        return None
+
+    input_id = card.get("input_id")
+    if not input_id:
+        return None
+    if isinstance(input_id, float) and orjson is not None:
+        # orjson reads integers past 64 bits as floats; keep card numbers exact
+        input_id = json.loads(content)["input_id"]
+
+    reference = card.get("input_provider_reference")
+    provider_ref = reference.get("identifier") if isinstance(reference, dict) else None
+    return _card(input_id, card.get("label"), provider_ref)
+
+
+def card_from_fields(fields):
+    """Like card_from_content, for the [input_id, label, identifier] array of CARD_FIELDS_SQL"""
+    input_id, label, provider_ref = parse_json(fields)
+    if not input_id:
+        return None
+    if isinstance(input_id, float) and orjson is not None:
+        input_id = json.loads(fields)[0]
+    return _card(input_id, label, provider_ref)
+
+
+def _card(input_id, label, provider_ref):
+    if not isinstance(provider_ref, str):
+        provider_ref = None
+    return {
+        'number': str(input_id),
+        'label': label,
+        'provider_ref': provider_ref,
+        'provider_id': provider_id_from_ref(provider_ref) if provider_ref else None,
+    }
+
+
+def connect_readonly(path, immutable=None, mmap_size=DEFAULT_MMAP_SIZE, cache_kib=DEFAULT_CACHE_KIB):
+    """Open a backup read-only, without file locking when it is immutable.
+
+    immutable=None treats the backup as immutable unless it has a non-empty
+    -wal file next to it, whose changes an immutable open would not see, or
+    a non-empty -journal, a hot rollback journal from an interrupted write.
+    Read-only, SQLite cannot roll that back and refuses to read the backup
+    (sqlite3.OperationalError) rather than return half-written data. A
+    missing backup raises sqlite3.OperationalError too, instead of creating
+    an empty database.
+    """
+    if immutable is None:
+        immutable = True
+        for suffix in ("-wal", "-journal"):
+            try:
+                if os.path.getsize(f"{path}{suffix}") > 0:
+                    immutable = False
+            except OSError:
+                pass
+    # SQLite URIs only need %, ? and # escaped; file:/C:/... is a Windows drive path
+    uri_path = os.path.abspath(path).replace(os.sep, "/")
+    uri_path = uri_path.replace("%", "%25").replace("?", "%3F").replace("#", "%23")
+    uri = "file:" + (uri_path if uri_path.startswith("/") else "/" + uri_path) + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = {-int(cache_kib)}")
+    return conn
+
+
+class SyncDatabase:
+    """Read access to a Stocard sync_db keyed on the collection column.
+
+    Every lookup is a range scan on collection, served by the backup's own
+    index when it has one or by a temporary index built on first use.
+    Pass a stocard_metrics.Metrics to record time, rows and bytes per stage.
+    The backup is opened read-only, see connect_readonly for the options.
+    """
+
+    def __init__(self, path="sync_db", metrics=None, immutable=None,
+                 mmap_size=DEFAULT_MMAP_SIZE, cache_kib=DEFAULT_CACHE_KIB):
+        self.path = path
+        self.conn = connect_readonly(path, immutable, mmap_size, cache_kib)
+        self.metrics = metrics or NULL_METRICS
+        self._source = None
+        self._json1 = None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _has_collection_index(self):
+        for row in self.conn.execute("PRAGMA index_list(synced_resources)"):
+            columns = self.conn.execute(f"PRAGMA index_info('{row[1]}')").fetchall()
+            if columns and columns[0][2] == "collection":
+                return True
+        return False
+
+    def _collection_source(self):
+        """Return (from_clause, key_column) to use for collection range scans"""
+        if self._source is None:
+            if self._has_collection_index():
+                self._source = ("synced_resources r", "r.collection")
+            else:
+                # Backup has no usable index: copy (rowid, collection) into a
+                # temporary indexed table once, without touching content BLOBs
+                with self.metrics.stage("collection_index"):
+                    self.conn.execute("""
+                        CREATE TEMP TABLE IF NOT EXISTS collection_index AS
+                        SELECT rowid AS rid, collection FROM synced_resources
+                    """)
+                    self.conn.execute("""
+                        CREATE INDEX IF NOT EXISTS temp.collection_index_key
+                        ON collection_index (collection, rid)
+                    """)
+                self._source = (
+                    "temp.collection_index i JOIN synced_resources r ON r.rowid = i.rid",
+                    "i.collection",
+                )
+        return self._source
+
+    def _range(self, columns, prefix, where="", params=(), limit=None):
+        """Select columns of rows whose collection starts with prefix"""
+        source, key = self._collection_source()
+        sql = f"SELECT {columns} FROM {source} WHERE {key} >= ? AND {key} < ?"
+        if where:
+            sql += f" AND {where}"
+        # Keep the table order the original full scans returned
+        sql += " ORDER BY r.rowid"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self.conn.execute(sql, (prefix, prefix_upper_bound(prefix)) + tuple(params))
+
+    def _next_collection(self, lower, upper):
+        """First collection in [lower, upper) that has a row not marked deleted"""
+        source, key = self._collection_source()
+        row = self.conn.execute(
+            f"SELECT {key} FROM {source} WHERE {key} >= ? AND {key} < ? AND r.deleted = 0 "
+            f"ORDER BY {key} LIMIT 1",
+            (lower, upper),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _owner_record_rowid(self, user_id):
+        """Rowid of the /users/<id> record naming user_id as distinct_backend_id, or None"""
+        source, key = self._collection_source()
+        rows = self.conn.execute(
+            f"SELECT r.rowid, r.content FROM {source} WHERE {key} = ? AND r.deleted = 0 ORDER BY r.rowid",
+            (f"/users/{user_id}",),
+        )
+        for rowid, content in rows:
+            content = parse_json(content)
+            if isinstance(content, dict) and content.get("distinct_backend_id") == user_id:
+                return rowid
+        return None
+
+    def _like_scan_user(self):
+        """distinct_backend_id of the first record holding one, read by a full scan"""
+        with self.metrics.stage("user_like_scan"):
+            row = self.conn.execute("""
+                SELECT content FROM synced_resources
+                WHERE content LIKE '%distinct_backend_id%' AND deleted = 0
+            """).fetchone()
+        content = parse_json(row[0]) if row else None
+        if isinstance(content, dict) and content.get("distinct_backend_id"):
+            return content["distinct_backend_id"]
+        return None
+
+    def user_ids(self):
+        """Return the user ids that own live resources under /users/, account owner first.
+
+        The owner is the user whose record holds distinct_backend_id, as
+        other ids (shared cards, leftovers of an earlier login) can sort
+        before it.
+        """
+        with self.metrics.stage("user_discovery") as stage:
+            users = self._user_ids()
+            stage.count(rows=len(users))
+        return users
+
+    def _user_ids(self):
+        users = []
+        lower, upper = "/users/", prefix_upper_bound("/users/")
+        # Skip-scan: one index seek per user instead of reading every row
+        collection = self._next_collection(lower, upper)
+        while collection is not None:
+            user_id = collection[len("/users/"):].split('/')[0]
+            if user_id:
+                users.append(user_id)
+            lower = prefix_upper_bound(f"/users/{user_id}/") if user_id else collection + "\0"
+            collection = self._next_collection(lower, upper)
+
+        # Owner first; when several records name themselves, the earliest one wins
+        owners = sorted((rowid, user_id) for user_id in users
+                        for rowid in [self._owner_record_rowid(user_id)] if rowid is not None)
+        if owners:
+            owner = owners[0][1]
+        else:
+            # Unknown layout: fall back to scanning for the record holding distinct_backend_id
+            owner = self._like_scan_user()
+        if owner:
+            users = [owner] + [user_id for user_id in users if user_id != owner]
+        return users
+
+    def iter_card_rows(self, user_id, batch_size=500):
+        """Yield (rowid, collection, content) of the user's non-deleted card rows.
+
+        Only rowids go through the sort, and content is fetched one batch
+        at a time, so memory stays flat however many cards there are.
+        """
+        for rows in self.iter_card_row_batches(user_id, batch_size):
+            yield from rows
+
+    def _card_rowid_batches(self, user_id, batch_size):
+        with self.metrics.stage("card_query"):
+            rowids = self._range("r.rowid", f"/users/{user_id}/loyalty-cards/", "r.deleted = 0")
+        while True:
+            with self.metrics.stage("card_query"):
+                batch = [rowid for (rowid,) in rowids.fetchmany(batch_size)]
+            if not batch:
+                return
+            yield batch
+
+    def iter_card_row_batches(self, user_id, batch_size=500):
+        """Like iter_card_rows, but yield a list of up to batch_size rows at a time"""
+        for batch in self._card_rowid_batches(user_id, batch_size):
+            yield self.card_rows(batch)
+
+    def card_rows(self, rowids):
+        """Return (rowid, collection, content) of the given rows, in rowid order"""
+        with self.metrics.stage("card_query") as stage:
+            placeholders = ", ".join("?" * len(rowids))
+            rows = self.conn.execute(f"""
+                SELECT rowid, collection, content FROM synced_resources
+                WHERE rowid IN ({placeholders}) ORDER BY rowid
+            """, list(rowids)).fetchall()
+            if self.metrics.enabled:
+                stage.count(rows=len(rows), bytes_read=sum(len(row[2] or b"") for row in rows))
+        return rows
+
+    def iter_card_stamps(self, user_id, batch_size=500):
+        """Yield lists of (rowid, collection, length in bytes) of the user's card rows.
+
+        Content is not read: SQLite takes the length of a value cast to a
+        BLOB from the record header. This is the cheap first pass of an
+        incremental extraction.
+        """
+        with self.metrics.stage("card_query"):
+            rows = self._range("r.rowid, r.collection, length(CAST(r.content AS BLOB))",
+                               f"/users/{user_id}/loyalty-cards/", "r.deleted = 0")
+        while True:
+            with self.metrics.stage("card_query") as stage:
+                batch = rows.fetchmany(batch_size)
+                stage.count(rows=len(batch))
+            if not batch:
+                return
+            yield batch
+
+    def has_json1(self):
+        """Whether this SQLite build has the JSON1 functions"""
+        if self._json1 is None:
+            try:
+                self.conn.execute("SELECT json_valid('{}')").fetchone()
+                self._json1 = True
+            except sqlite3.OperationalError:
+                self._json1 = False
+        return self._json1
+
+    def iter_cards(self, user_id, batch_size=500, with_ids=False):
+        """Yield parsed, non-deleted loyalty cards that have a card number.
+
+        With JSON1, SQLite extracts the three fields used and drops rows
+        without a card number, so whole documents are not parsed in Python.
+        with_ids yields (card_id, card) pairs instead, card_id being the
+        row's collection path, which stays the same when a card is edited.
+        """
+        if not self.has_json1():
+            for rows in self.iter_card_row_batches(user_id, batch_size):
+                with self.metrics.stage("json_parse") as stage:
+                    cards = [(collection, card_from_content(content)) for rowid, collection, content in rows]
+                    stage.count(rows=len(rows))
+                for card_id, card in cards:
+                    if card is not None:
+                        yield (card_id, card) if with_ids else card
+            return
+
+        for batch in self._card_rowid_batches(user_id, batch_size):
+            with self.metrics.stage("card_query") as stage:
+                sql = CARD_FIELDS_SQL.format(placeholders=", ".join("?" * len(batch)))
+                rows = self.conn.execute(sql, batch).fetchall()
+                stage.count(rows=len(rows))
+            with self.metrics.stage("json_parse") as stage:
+                cards = [(collection, card_from_content(doc) if doc is not None else card_from_fields(fields))
+                         for fields, doc, collection in rows]
+                stage.count(rows=len(rows))
+            for card_id, card in cards:
+                if card is not None:
+                    yield (card_id, card) if with_ids else card
+
+    def count_cards(self, user_id):
+        """Number of non-deleted card rows, for progress reporting"""
+        row = self._range("count(*)", f"/users/{user_id}/loyalty-cards/", "r.deleted = 0").fetchone()
+        return row[0]
+
+    def loyalty_cards(self, user_id):
+        """Return the parsed, non-deleted loyalty cards that have a card number, as a CardStore"""
+        return CardStore(self.iter_cards(user_id))
+
+    def _provider_image_rowids(self, provider_refs, chunk_size=200):
+        """Yield {provider_ref: rowid} of the first image row, one dict per chunk"""
+        refs = list(dict.fromkeys(ref for ref in provider_refs if ref))
+        source, key = self._collection_source()
+        for start in range(0, len(refs), chunk_size):
+            chunk = refs[start:start + chunk_size]
+            # Prefix ranges are either nested or disjoint, so keep only the
+            # outermost ones and every row comes back once
+            wanted = set(chunk)
+            outer = []
+            for ref in sorted(wanted):
+                if not outer or not ref.startswith(outer[-1]):
+                    outer.append(ref)
+            values = ", ".join("(?, ?)" for _ in outer)
+            params = []
+            for ref in outer:
+                params += [ref, prefix_upper_bound(ref)]
+
+            # The CROSS JOIN keeps the ranges as the outer loop, so every ref
+            # is one index seek even when the planner would rather scan
+            chosen = {}
+            rows = self.conn.execute(f"""
+                WITH ranges(lower, upper) AS (VALUES {values})
+                SELECT r.rowid, {key} FROM ranges CROSS JOIN {source}
+                WHERE {key} >= ranges.lower AND {key} < ranges.upper
+                AND r.content_type LIKE 'image/%' AND r.deleted = 0
+                ORDER BY r.rowid
+            """, params)
+            for rowid, collection in rows:
+                # Credit the row to the longest requested ref it starts with
+                for end in range(len(collection), 0, -1):
+                    ref = collection[:end]
+                    if ref in wanted:
+                        break
+                if ref not in chosen:
+                    chosen[ref] = rowid
+            yield chosen
+
+    def _select_by_rowid(self, columns, by_rowid):
+        placeholders = ", ".join("?" * len(by_rowid))
+        return self.conn.execute(f"""
+            SELECT rowid, {columns} FROM synced_resources
+            WHERE rowid IN ({placeholders})
+        """, list(by_rowid))
+
+    def provider_images(self, provider_refs, chunk_size=200, stream_over=None):
+        """Return {provider_ref: (image_data, content_type)} for the given refs.
+
+        Each distinct ref is resolved once, with one indexed query per chunk
+        of refs instead of one query per card. BLOBs are only read for the
+        chosen image rows. With stream_over, a BLOB longer than that many
+        bytes is not read here: its image_data is an iter_blob generator.
+        """
+        images = {}
+        columns = "content, content_type"
+        if stream_over is not None:
+            columns = f"CASE WHEN length(content) <= {int(stream_over)} THEN content END, content_type"
+        with self.metrics.stage("image_read") as stage:
+            for chosen in self._provider_image_rowids(provider_refs, chunk_size):
+                if not chosen:
+                    continue
+                by_rowid = {rowid: ref for ref, rowid in chosen.items()}
+                for rowid, content, content_type in self._select_by_rowid(columns, by_rowid):
+                    if content is None and stream_over is not None:
+                        content = self.iter_blob(rowid)
+                    else:
+                        stage.count(bytes_read=len(content))
+                    images[by_rowid[rowid]] = (content, content_type)
+                    stage.count(rows=1)
+        return images
+
+    def iter_blob(self, rowid, chunk_size=BLOB_CHUNK_SIZE):
+        """Yield the content of a row in chunks, never holding all of it.
+
+        Uses incremental BLOB I/O (Connection.blobopen, Python 3.11+); older
+        Pythons, and values SQLite cannot open as a BLOB, are read whole.
+        """
+        read = 0
+        blob = None
+        if hasattr(self.conn, "blobopen"):
+            try:
+                blob = self.conn.blobopen("synced_resources", "content", rowid, readonly=True)
+            except sqlite3.Error:
+                pass
+        if blob is not None:
+            with blob:
+                chunk = blob.read(chunk_size)
+                while chunk:
+                    read += len(chunk)
+                    yield chunk
+                    chunk = blob.read(chunk_size)
+        else:
+            row = self.conn.execute("SELECT content FROM synced_resources WHERE rowid = ?", (rowid,)).fetchone()
+            content = row[0] if row else None
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            if content:
+                read = len(content)
+                yield content
+        self.metrics.count("image_read", bytes_read=read)
+
+    def provider_image_fingerprints(self, provider_refs, chunk_size=200, checksum=False):
+        """Return {provider_ref: fingerprint} of each chosen image row.
+
+        The fingerprint is "rowid:length:content_type", which no BLOB is
+        read for. A logo rewritten in place at the same size keeps it; pass
+        checksum=True to get "length:crc32:content_type" instead, which
+        reads every image (BLOBs over STREAM_THRESHOLD chunk by chunk).
+        """
+        fingerprints = {}
+        columns = "length(content), content_type"
+        if checksum:
+            columns += f", CASE WHEN length(content) <= {STREAM_THRESHOLD} THEN content END"
+        with self.metrics.stage("image_fingerprint") as stage:
+            for chosen in self._provider_image_rowids(provider_refs, chunk_size):
+                if not chosen:
+                    continue
+                by_rowid = {rowid: ref for ref, rowid in chosen.items()}
+                for rowid, length, content_type, *content in self._select_by_rowid(columns, by_rowid):
+                    stage.count(rows=1)
+                    if not checksum:
+                        fingerprints[by_rowid[rowid]] = f"{rowid}:{length}:{content_type}"
+                        continue
+                    content = content[0]
+                    if content is None and length:
+                        crc = 0
+                        for chunk in self.iter_blob(rowid):
+                            crc = zlib.crc32(chunk, crc)
+                    else:
+                        if isinstance(content, str):
+                            content = content.encode("utf-8")
+                        crc = zlib.crc32(content or b"")
+                        stage.count(bytes_read=len(content or b""))
+                    fingerprints[by_rowid[rowid]] = f"{length}:{crc:08x}:{content_type}"
+        return fingerprints
+
+    def provider_image(self, provider_ref):
+        """Return (image_data, content_type) of a provider logo, or None"""
+        return self.provider_images([provider_ref]).get(provider_ref)
+
+
+def load_all(path="sync_db", with_images=True, metrics=None):
+    """Load users, the first user's loyalty cards and their provider images"""
+    with SyncDatabase(path, metrics) as db:
+        users = db.user_ids()
+        cards = db.loyalty_cards(users[0]) if users else []
+        images = {}
+        if with_images:
+            images = db.provider_images(card['provider_ref'] for card in cards)
+    return LoadResult(users, cards, images)
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import shutil
+
+from stocard_metrics import NULL_METRICS
+
+# Logo sizes the viewers display: stocard_viewer.py and stocard_gui.py
+THUMBNAIL_SIZES = ((100, 100), (80, 80))
+
+
+INDEX_NAME = "index.json"
+
+
+def load_index(logo_dir):
+    """Return the parsed index.json of logo_dir, or {} if missing or unreadable"""
+    try:
+        with open(os.path.join(logo_dir, INDEX_NAME), encoding="utf-8") as f:
+            index = json.load(f)
+        if isinstance(index.get("providers"), dict):
+            return index
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {}
+
+
+def size_key(size):
+    return f"{size[0]}x{size[1]}"
+
+
+def make_thumbnail(job):
+    """Resize one image to an RGBA PNG; job is (source, target, size). Runs in a worker process."""
+    from PIL import Image
+
+    source, target, size = job
+    try:
+        with Image.open(source) as image:
+            thumbnail = image.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        thumbnail.save(tmp, format="PNG")
+        os.replace(tmp, target)
+        return target, None
+    except Exception as e:
+        return target, f"{type(e).__name__}: {e}"
+
+
+class LogoStore:
+    """Content-addressed store for provider logos.
+
+    Each distinct image is written once to objects/<sha256>.<ext>, and
+    logos/<provider_id>.<ext> is a hard link to it (a copy where links are
+    not supported). index.json maps provider ids to hashes, so a logo that
+    has not changed since the last run costs a hash and nothing else. It
+    also lists the thumbnails made from each image, and the images that
+    could not be decoded, see make_thumbnails.
+    """
+
+    def __init__(self, logo_dir="logos", metrics=None):
+        self.logo_dir = logo_dir
+        self.metrics = metrics or NULL_METRICS
+        self.objects_dir = os.path.join(logo_dir, "objects")
+        self.thumbs_dir = os.path.join(logo_dir, "thumbs")
+        self.index_path = os.path.join(logo_dir, INDEX_NAME)
+        index = load_index(logo_dir)
+        self.providers = index.get("providers", {})
+        self.thumbnails = index.get("thumbnails", {})
+        self.failed = index.get("failed", {})
+        self.written = 0
+        self._dirty = False
+
+    def provider_path(self, provider_id, ext):
+        return f"{self.logo_dir}/{provider_id}.{ext}"
+
+    def save(self, provider_id, image):
+        """Store (image_data, content_type) for a provider and return its path.
+
+        image_data is bytes, or an iterable of bytes chunks (a BLOB streamed
+        from the backup) which is hashed while it is spooled to disk.
+        """
+        with self.metrics.stage("logo_write") as stage:
+            stage.count(rows=1)
+            return self._save(provider_id, image, stage)
+
+    def _save(self, provider_id, image, stage):
+        image_data, content_type = image
+        # Determine file extension from content type
+        ext = content_type.split('/')[-1] if '/' in content_type else 'png'
+        spooled = None
+        if isinstance(image_data, (bytes, bytearray)):
+            digest = hashlib.sha256(image_data).hexdigest()
+        else:
+            digest, spooled = self._spool(image_data, stage)
+        path = self.provider_path(provider_id, ext)
+
+        entry = self.providers.get(provider_id)
+        if entry and entry["hash"] == digest and entry["ext"] == ext and os.path.exists(path):
+            if spooled:
+                os.remove(spooled)
+            return path
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        obj = os.path.join(self.objects_dir, f"{digest}.{ext}")
+        if os.path.exists(obj):
+            if spooled:
+                os.remove(spooled)
+        elif spooled:
+            os.replace(spooled, obj)
+            self.written += 1
+        else:
+            tmp = f"{obj}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(image_data)
+            os.replace(tmp, obj)
+            self.written += 1
+            stage.count(bytes_written=len(image_data))
+
+        # Drop the previous logo if the provider changed format
+        if entry and entry["ext"] != ext:
+            old = self.provider_path(provider_id, entry["ext"])
+            if os.path.exists(old):
+                os.remove(old)
+        self._link(obj, path)
+
+        self.providers[provider_id] = {"hash": digest, "ext": ext}
+        self._dirty = True
+        return path
+
+    def _spool(self, chunks, stage):
+        """Write chunks to a temporary file in objects/; return (sha256, tmp path)"""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        tmp = os.path.join(self.objects_dir, f"spool.{os.getpid()}.tmp")
+        sha = hashlib.sha256()
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                sha.update(chunk)
+                f.write(chunk)
+                stage.count(bytes_written=len(chunk))
+        return sha.hexdigest(), tmp
+
+    def _link(self, obj, path):
+        tmp = f"{path}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            shutil.copyfile(obj, tmp)
+        os.replace(tmp, path)
+
+    def flush(self):
+        """Write index.json if anything changed"""
+        if not self._dirty:
+            return
+        os.makedirs(self.logo_dir, exist_ok=True)
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"providers": self.providers, "thumbnails": self.thumbnails,
+                       "failed": self.failed}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_path)
+        self._dirty = False
+
+    def make_thumbnails(self, sizes=THUMBNAIL_SIZES, workers=None):
+        """Render every stored image at every size into thumbs/, in parallel.
+
+        Thumbnails are named by the source image hash, so each distinct
+        image is resized once per size however many providers share it, and
+        ones made by an earlier run are kept. Images that failed to decode
+        are recorded by hash and not retried until the provider's logo
+        changes. workers=1 renders in this process. Returns the number of
+        thumbnails rendered.
+        """
+        stored = sorted({(e["hash"], e["ext"]) for e in self.providers.values()})
+        # Forget failures of images no provider uses any more
+        hashes = {digest for digest, _ in stored}
+        failed = {digest: error for digest, error in self.failed.items() if digest in hashes}
+        if len(failed) != len(self.failed):
+            self.failed = failed
+            self._dirty = True
+        jobs = []
+        for digest, ext in stored:
+            if digest in self.failed:
+                continue
+            made = self.thumbnails.setdefault(digest, {})
+            for size in sizes:
+                relpath = f"thumbs/{digest}-{size_key(size)}.png"
+                if made.get(size_key(size)) == relpath and os.path.exists(os.path.join(self.logo_dir, relpath)):
+                    continue
+                made.pop(size_key(size), None)
+                source = os.path.join(self.objects_dir, f"{digest}.{ext}")
+                jobs.append((source, os.path.join(self.logo_dir, relpath), tuple(size)))
+        if not jobs:
+            return 0
+
+        os.makedirs(self.thumbs_dir, exist_ok=True)
+        with self.metrics.stage("thumbnails") as stage:
+            if workers == 1 or len(jobs) == 1:
+                made = self._record_thumbnails(jobs, map(make_thumbnail, jobs), stage)
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    results = pool.map(make_thumbnail, jobs, chunksize=max(len(jobs) // 64, 1))
+                    made = self._record_thumbnails(jobs, results, stage)
+        self._dirty = True
+        return made
+
+    def _record_thumbnails(self, jobs, results, stage):
+        made = 0
+        for (source, target, size), (_, error) in zip(jobs, results):
+            digest = os.path.basename(source).split(".")[0]
+            if error:
+                print(f"Error making thumbnail of {source}: {error}")
+                self.failed[digest] = error
+                continue
+            self.thumbnails[digest][size_key(size)] = f"thumbs/{os.path.basename(target)}"
+            stage.count(rows=1, bytes_written=os.path.getsize(target))
+            made += 1
+        return made
+
+    def __len__(self):
+        return len(self.providers)
+
+
+class LogoManifest:
+    """Read-only view of a LogoStore's index.json for the viewers.
+
+    Answers "which file shows provider X at this size" from the index
+    alone, whatever the logo's extension, so no per-card os.path.exists
+    probing is needed. Logo directories without an index (older extractor
+    output) fall back to looking for <provider_id>.png.
+    """
+
+    def __init__(self, logo_dir="logos"):
+        self.logo_dir = logo_dir
+        index = load_index(logo_dir)
+        self.providers = index.get("providers", {})
+        self.thumbnails = index.get("thumbnails", {})
+        self.indexed = bool(index)
+
+    def logo_path(self, provider_id):
+        """Path of the full-size logo, or None"""
+        entry = self.providers.get(provider_id)
+        if entry:
+            return f"{self.logo_dir}/{provider_id}.{entry['ext']}"
+        if not self.indexed and provider_id:
+            path = f"{self.logo_dir}/{provider_id}.png"
+            if os.path.exists(path):
+                return path
+        return None
+
+    def thumbnail_path(self, provider_id, size):
+        """Path of a ready-made thumbnail at size, or None"""
+        entry = self.providers.get(provider_id)
+        if not entry:
+            return None
+        relpath = self.thumbnails.get(entry["hash"], {}).get(size_key(size))
+        return f"{self.logo_dir}/{relpath}" if relpath else None
+
+    def display_path(self, provider_id, size):
+        """Thumbnail at size if there is one, else the full-size logo"""
+        return self.thumbnail_path(provider_id, size) or self.logo_path(provider_id)
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _Stage:
+    """One timed pass through a stage; counts added here go to that stage"""
+
+    __slots__ = ("metrics", "name", "start", "rows", "bytes_read", "bytes_written")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.rows = self.bytes_read = self.bytes_written = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._add(self.name, time.perf_counter() - self.start,
+                          self.rows, self.bytes_read, self.bytes_written)
+
+    def count(self, rows=0, bytes_read=0, bytes_written=0):
+        self.rows += rows
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+
+class Metrics:
+    """Wall time, rows, bytes read and bytes written per named stage.
+
+    A stage is usually entered once per batch; its numbers add up over all
+    calls. Safe to use from worker threads.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Context manager timing one pass through stage `name`"""
+        return _Stage(self, name)
+
+    def count(self, name, rows=0, bytes_read=0, bytes_written=0):
+        """Add counts to a stage without timing anything"""
+        self._add(name, 0.0, rows, bytes_read, bytes_written, calls=0)
+
+    def _add(self, name, seconds, rows, bytes_read, bytes_written, calls=1):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {"calls": 0, "seconds": 0.0, "rows": 0,
+                                             "bytes_read": 0, "bytes_written": 0}
+            stage["calls"] += calls
+            stage["seconds"] += seconds
+            stage["rows"] += rows
+            stage["bytes_read"] += bytes_read
+            stage["bytes_written"] += bytes_written
+
+    def report(self):
+        """Return the numbers collected so far as a JSON-ready dict"""
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        return {"wall_seconds": time.perf_counter() - self.started, "stages": stages}
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def count(self, rows=0, bytes_read=0, bytes_written=0):
+        pass
+
+
+class _NullMetrics:
+    """Stand-in used when instrumentation is off; every call is a no-op"""
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, rows=0, bytes_read=0, bytes_written=0):
+        pass
+
+    def report(self):
+        return {"wall_seconds": 0.0, "stages": {}}
+
+
+NULL_METRICS = _NullMetrics()
+
+
+@contextmanager
+def profiled(path):
+    """Run the block under cProfile and dump pstats data to path (if set)"""
+    if not path:
+        yield
+        return
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
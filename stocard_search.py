@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+# Fields a search looks at, in the order they are joined for matching
+SEARCH_FIELDS = ('label', 'number', 'provider_id')
+NGRAM = 3
+
+
+def normalize(text):
+    return str(text).casefold() if text is not None else ""
+
+
+class CardSearchIndex:
+    """Type-ahead substring search over label, card number and provider ID.
+
+    Every 3-character substring of a card's text maps to the cards that
+    contain it. A query term is looked up by intersecting its trigrams, and
+    the few candidates left are confirmed with a plain substring test.
+    Terms shorter than a trigram are checked against the candidates (or all
+    cards) directly. All terms must match. Typing more characters only
+    filters the previous result, so each keystroke gets cheaper.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.grams = defaultdict(set)
+        self._last_query = None
+        self._last_matches = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, card):
+        """Index a card dict; returns its index (cards are numbered as added)"""
+        index = len(self.texts)
+        # "\0" keeps n-grams from spanning two fields
+        text = "\0".join(normalize(card.get(field)) for field in SEARCH_FIELDS)
+        self.texts.append(text)
+        for start in range(len(text) - NGRAM + 1):
+            gram = text[start:start + NGRAM]
+            if "\0" not in gram:
+                self.grams[gram].add(index)
+        if self._last_matches is not None and self.matches(index, self._last_query):
+            self._last_matches.append(index)
+        return index
+
+    def matches(self, index, query):
+        """True if card `index` matches every term of query"""
+        text = self.texts[index]
+        return all(term in text for term in normalize(query).split())
+
+    def search(self, query):
+        """Return the matching card indexes in order, or None for an empty query"""
+        query = normalize(query)
+        terms = query.split()
+        if not terms:
+            self._last_query = self._last_matches = None
+            return None
+
+        # A query that extends the previous one can only match fewer cards
+        candidates = None
+        if self._last_query is not None and query.startswith(self._last_query):
+            candidates = set(self._last_matches)
+
+        for term in sorted(terms, key=len, reverse=True):
+            if len(term) < NGRAM:
+                continue
+            postings = sorted((self.grams.get(term[start:start + NGRAM], frozenset())
+                               for start in range(len(term) - NGRAM + 1)), key=len)
+            for posting in postings:
+                candidates = set(posting) if candidates is None else candidates & posting
+                if not candidates:
+                    break
+            if not candidates:
+                candidates = set()
+                break
+
+        texts = self.texts
+        pool = sorted(candidates) if candidates is not None else range(len(texts))
+        found = [index for index in pool if all(term in texts[index] for term in terms)]
+        self._last_query = query
+        self._last_matches = found
+        return list(found)
@@ -0,0 +1,382 @@
+"""Serve cards, barcodes and logos over HTTP for devices that cannot run Tk.
+
+    python stocard_server.py sync_db --host 0.0.0.0 --port 8080
+
+The backup is read once at start-up; after that no request touches it.
+Everything is standard library asyncio plus Pillow for the images:
+
+    GET /cards                  every card as JSON
+    GET /cards/<n>              one card
+    GET /cards/<n>/barcode.png  Code 128 barcode, ?width=400&height=100
+    GET /cards/<n>/logo.png     provider logo, ?size=100 to fit a square
+    GET /stats                  request and cache counters
+
+Rendered PNGs are kept in a least recently used cache bounded by count and
+bytes. Every response carries an ETag computed from what it is rendered
+from, so a matching If-None-Match is answered 304 without rendering at all.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from stocard_barcode import RENDER_VERSION, render_code128
+from stocard_loader import load_all
+
+DEFAULT_BARCODE_SIZE = (400, 100)
+BARCODE_WIDTHS = (64, 2000)
+BARCODE_HEIGHTS = (16, 1000)
+LOGO_SIZES = (16, 1024)
+
+# Requests larger than this are refused, and idle keep-alive connections closed
+MAX_HEADER_BYTES = 16 * 1024
+KEEPALIVE_SECONDS = 15
+
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 422: "Unprocessable Entity", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    """Encoded response bodies, evicting least recently used past either cap"""
+
+    def __init__(self, max_items=2048, max_bytes=64 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        body = self._items.get(key)
+        if body is not None:
+            self._items.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._items[key] = body
+        self.bytes += len(body)
+        while len(self._items) > self.max_items or (self.bytes > self.max_bytes and len(self._items) > 1):
+            _, evicted = self._items.popitem(last=False)
+            self.bytes -= len(evicted)
+
+
+def _etag(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()[:24]}"'
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses weak comparison
+    return "*" in candidates or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def _png(image):
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_barcode_png(card_number, size):
+    return _png(render_code128(card_number, size))
+
+
+def render_logo_png(data, size):
+    """PNG of a logo, fitted into size x size (scaling up too); size None keeps it as is"""
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as logo:
+        if size is None and logo.format == "PNG":
+            return bytes(data)
+        logo = logo.convert("RGBA")
+    if size is not None:
+        scale = size / max(logo.width, logo.height)
+        logo = logo.resize((max(round(logo.width * scale), 1), max(round(logo.height * scale), 1)),
+                           Image.Resampling.LANCZOS)
+    return _png(logo)
+
+
+class CardService:
+    """Answers requests from cards loaded once; rendering runs on a thread pool.
+
+    Concurrent requests for an image that is still being rendered wait for
+    that render rather than starting their own.
+    """
+
+    def __init__(self, cards, images, cache=None, workers=4):
+        self.cards = cards
+        self.images = images
+        self.cache = cache if cache is not None else ResponseCache()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self.stats = {"requests": 0, "not_modified": 0, "cache_hits": 0, "renders": 0, "errors": 0}
+        self._pending = {}
+        self._jobs = set()  # Renders submitted to the executor and not finished
+        self._logo_etags = {}
+
+        # Single cards are serialized per request; only the full list is kept
+        documents = [self._document(index, card) for index, card in enumerate(cards)]
+        self._list_body = json.dumps({"count": len(cards), "cards": documents}).encode("utf-8")
+        self._list_etag = _etag(self._list_body)
+
+    def close(self):
+        # Cancelled by hand, as shutdown(cancel_futures=True) needs Python 3.9
+        for job in list(self._jobs):
+            job.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _document(self, index, card):
+        has_logo = card.get('provider_ref') in self.images
+        return {
+            'index': index,
+            'label': card.get('label'),
+            'number': card['number'],
+            'provider_id': card.get('provider_id'),
+            'barcode': f"/cards/{index}/barcode.png",
+            'logo': f"/cards/{index}/logo.png" if has_logo else None,
+        }
+
+    def _card(self, part):
+        if not part.isdigit() or int(part) >= len(self.cards):
+            raise HTTPError(404, f"No card {part}")
+        return int(part)
+
+    def _logo(self, index):
+        ref = self.cards[index].get('provider_ref')
+        image = self.images.get(ref)
+        if image is None:
+            raise HTTPError(404, f"Card {index} has no logo")
+        etag = self._logo_etags.get(ref)
+        if etag is None:
+            etag = self._logo_etags[ref] = _etag(image[0])
+        return image[0], etag
+
+    async def handle(self, method, target, headers):
+        """Return (status, headers, body) for a request"""
+        self.stats["requests"] += 1
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(405, f"{method} is not supported")
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts == ["stats"]:
+            stats = dict(self.stats, cached_items=len(self.cache), cached_bytes=self.cache.bytes)
+            return 200, {"Content-Type": "application/json", "Cache-Control": "no-store"}, \
+                json.dumps(stats).encode("utf-8")
+        if parts == ["cards"]:
+            return self._static(headers, self._list_body, self._list_etag, "application/json", "no-cache")
+        if len(parts) == 2 and parts[0] == "cards":
+            index = self._card(parts[1])
+            body = json.dumps(self._document(index, self.cards[index])).encode("utf-8")
+            return self._static(headers, body, _etag(body), "application/json", "no-cache")
+        if len(parts) == 3 and parts[0] == "cards" and parts[2] == "barcode.png":
+            number = self.cards[self._card(parts[1])]['number']
+            size = (_int_param(query, "width", DEFAULT_BARCODE_SIZE[0], BARCODE_WIDTHS),
+                    _int_param(query, "height", DEFAULT_BARCODE_SIZE[1], BARCODE_HEIGHTS))
+            etag = _etag("barcode", RENDER_VERSION, number, size)
+            return await self._rendered(headers, etag, render_barcode_png, number, size)
+        if len(parts) == 3 and parts[0] == "cards" and parts[2] == "logo.png":
+            data, data_etag = self._logo(self._card(parts[1]))
+            size = _int_param(query, "size", None, LOGO_SIZES)
+            etag = _etag("logo", data_etag, size)
+            return await self._rendered(headers, etag, render_logo_png, data, size)
+        raise HTTPError(404, f"Nothing at {url.path}")
+
+    def _static(self, headers, body, etag, content_type, cache_control):
+        response = {"Content-Type": content_type, "ETag": etag, "Cache-Control": cache_control}
+        if _etag_matches(headers.get("if-none-match"), etag):
+            self.stats["not_modified"] += 1
+            return 304, response, b""
+        return 200, response, body
+
+    async def _rendered(self, headers, etag, render, *args):
+        """Serve a PNG from the cache, rendering it on the thread pool on a miss"""
+        response = {"Content-Type": "image/png", "ETag": etag, "Cache-Control": "max-age=3600"}
+        if _etag_matches(headers.get("if-none-match"), etag):
+            self.stats["not_modified"] += 1
+            return 304, response, b""
+
+        body = self.cache.get(etag)
+        if body is not None:
+            self.stats["cache_hits"] += 1
+            return 200, response, body
+
+        future = self._pending.get(etag)
+        if future is None:
+            self.stats["renders"] += 1
+            job = self.executor.submit(render, *args)
+            self._jobs.add(job)
+            job.add_done_callback(self._jobs.discard)
+            future = asyncio.wrap_future(job)
+            future.add_done_callback(lambda done: self._rendered_done(etag, done))
+            self._pending[etag] = future
+        try:
+            # Shielded: a client going away must not cancel a render others wait for
+            body = await asyncio.shield(future)
+        except ValueError as e:
+            raise HTTPError(422, str(e))
+        return 200, response, body
+
+    def _rendered_done(self, etag, future):
+        del self._pending[etag]
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(etag, future.result())
+
+
+def _int_param(query, name, default, limits):
+    value = query.get(name)
+    if value is None:
+        return default
+    if not value.isdigit():
+        raise HTTPError(400, f"{name} must be a whole number")
+    low, high = limits
+    return min(max(int(value), low), high)
+
+
+async def _read_request(reader):
+    """Return (method, target, version, headers), or None once the client is done"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SECONDS)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "Request headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+
+    # GET and HEAD carry no body, but skip one if a client sends it anyway
+    length = headers.get("content-length", "0")
+    if not length.isdigit() or int(length) > MAX_HEADER_BYTES:
+        raise HTTPError(400, "Unsupported request body")
+    if int(length):
+        await reader.readexactly(int(length))
+    return method, target, version, headers
+
+
+def _keep_alive(version, headers):
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+def _write_response(writer, status, headers, body, keep_alive, head_only=False):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    lines.append(f"Content-Length: {len(body)}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    if body and not head_only:
+        writer.write(body)
+
+
+async def serve_connection(service, reader, writer):
+    """Answer requests on one connection until the client closes it or goes idle"""
+    try:
+        while True:
+            keep_alive = False
+            method = None
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                keep_alive = _keep_alive(version, headers)
+                status, response, body = await service.handle(method, target, headers)
+            except HTTPError as e:
+                service.stats["errors"] += 1
+                status, response = e.status, {"Content-Type": "application/json"}
+                body = json.dumps({"error": str(e)}).encode("utf-8")
+            except Exception as e:
+                service.stats["errors"] += 1
+                print(f"Error handling request: {e}")
+                status, response = 500, {"Content-Type": "application/json"}
+                body = json.dumps({"error": "internal error"}).encode("utf-8")
+            _write_response(writer, status, response, body, keep_alive, method == "HEAD")
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve(service, host="127.0.0.1", port=8080, on_ready=None):
+    """Run the HTTP server until cancelled"""
+    server = await asyncio.start_server(lambda reader, writer: serve_connection(service, reader, writer),
+                                        host, port, limit=MAX_HEADER_BYTES)
+    if on_ready:
+        on_ready(server.sockets[0].getsockname())
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", nargs="?", default="sync_db", help="path to the sync_db backup")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (0.0.0.0 for the network)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on, 0 picks a free one")
+    parser.add_argument("--workers", type=int, default=4, help="threads rendering barcodes and logos")
+    parser.add_argument("--cache-items", type=int, default=2048, help="rendered images kept in memory")
+    parser.add_argument("--cache-mb", type=int, default=64, help="memory for rendered images, in MiB")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    users, cards, images = load_all(args.database)
+    if not users:
+        print(f"No user found in {args.database}")
+        return
+    service = CardService(cards, images, ResponseCache(args.cache_items, args.cache_mb * 1024 * 1024),
+                          args.workers)
+    print(f"Loaded {len(cards)} cards and {len(images)} logos in {time.perf_counter() - start:.2f}s")
+
+    def ready(address):
+        print(f"Serving on http://{address[0]}:{address[1]}/", flush=True)
+
+    try:
+        asyncio.run(serve(service, args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
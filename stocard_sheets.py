@@ -0,0 +1,335 @@
+"""Render printable barcode sheets for extracted cards, as PDF or PNG pages.
+
+    python stocard_sheets.py batch_output/ --output sheets --format pdf --paper a4 --workers 8
+
+Reads the cards.jsonl files written by stocard_batch.py or by
+stocard_extractor.py --incremental (directories are searched for them) and
+lays out each account's cards, with logo, label, number and Code 128
+barcode, COLUMNS x ROWS to a page. Pages are rendered in a process pool and
+written to disk in order as they finish, so only a few pages are in memory
+at any time however many accounts are exported.
+"""
+import json
+import os
+import zlib
+from collections import deque, namedtuple
+from functools import lru_cache
+
+from stocard_barcode import code128_modules, rasterize_modules
+from stocard_cards import CardStore
+from stocard_logos import LogoManifest
+
+# Paper sizes in inches
+PAPER_SIZES = {"a4": (210 / 25.4, 297 / 25.4), "letter": (8.5, 11.0)}
+COLUMNS = 2
+ROWS = 5
+
+# Layout in inches
+MARGIN = 0.4
+FOOTER = 0.3
+PADDING = 0.12
+LOGO_SIZE = 0.6
+BARCODE_HEIGHT = 0.55
+
+# zlib level for page images: 3 is about as fast as 1 and much smaller
+PAGE_COMPRESSION = 3
+
+# One page of one account; cards carry number, label and a resolved logo_path
+PageJob = namedtuple("PageJob", ["account", "page", "pages", "cards", "fmt", "paper", "dpi", "target"])
+
+
+def find_card_files(paths):
+    """Yield cards.jsonl files given directly or found under directories"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if "cards.jsonl" in files:
+                yield os.path.join(root, "cards.jsonl")
+
+
+def load_account(cards_path):
+    """Read one cards.jsonl, resolving logos through the logos/ next to it"""
+    logos = LogoManifest(os.path.join(os.path.dirname(cards_path), "logos"))
+    cards = CardStore()
+    with open(cards_path, encoding="utf-8") as f:
+        for line in f:
+            card = json.loads(line)
+            logo_path = logos.logo_path(card.get('provider_id')) or card.get('logo_path')
+            cards.append({'number': card['number'], 'label': card.get('label'), 'logo_path': logo_path})
+    return cards
+
+
+def iter_page_jobs(card_files, out_dir, fmt, paper, dpi):
+    """Yield a PageJob per page, account after account"""
+    per_page = COLUMNS * ROWS
+    names = set()
+    for cards_path in card_files:
+        # Accounts are named after the directory holding their cards.jsonl
+        name = os.path.basename(os.path.dirname(os.path.abspath(cards_path))) or "cards"
+        unique, suffix = name, 2
+        while unique in names:
+            unique, suffix = f"{name}-{suffix}", suffix + 1
+        names.add(unique)
+
+        cards = load_account(cards_path)
+        pages = (len(cards) + per_page - 1) // per_page
+        if fmt == "png" and pages:
+            os.makedirs(os.path.join(out_dir, unique), exist_ok=True)
+        for page in range(pages):
+            if fmt == "png":
+                target = os.path.join(out_dir, unique, f"page-{page + 1:04d}.png")
+            else:
+                target = os.path.join(out_dir, f"{unique}.pdf")
+            # Plain dicts, as jobs are pickled to the rendering processes
+            page_cards = [card.as_dict() for card in cards[page * per_page:(page + 1) * per_page]]
+            yield PageJob(unique, page + 1, pages, page_cards, fmt, paper, dpi, target)
+
+
+@lru_cache(maxsize=8)
+def _font(size):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()  # Pillow < 10.1: fixed-size bitmap font
+
+
+@lru_cache(maxsize=256)
+def _logo(path, size):
+    """A logo scaled to fit size x size, cached per worker process; None if unreadable"""
+    from PIL import Image
+
+    if not path:
+        return None
+    try:
+        with Image.open(path) as logo:
+            logo = logo.convert("RGBA")
+        # Scale up as well as down, small logos would otherwise print as a speck
+        scale = size / max(logo.width, logo.height)
+        fitted = (max(round(logo.width * scale), 1), max(round(logo.height * scale), 1))
+        return logo.resize(fitted, Image.Resampling.LANCZOS)
+    except Exception:
+        return None
+
+
+def _fit(draw, text, font, width):
+    """Shorten text with an ellipsis until it fits width pixels"""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "...", font=font) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def _px(inches, dpi):
+    return int(round(inches * dpi))
+
+
+def _draw_card(page, draw, card, box, dpi):
+    x, y, width, height = box
+    pad = _px(PADDING, dpi)
+
+    # Cut guide
+    inset = _px(0.04, dpi)
+    draw.rectangle((x + inset, y + inset, x + width - inset, y + height - inset),
+                   outline=(190, 190, 190), width=max(dpi // 100, 1))
+
+    logo_size = _px(LOGO_SIZE, dpi)
+    logo = _logo(card['logo_path'], logo_size)
+    if logo is not None:
+        offset = ((logo_size - logo.width) // 2, (logo_size - logo.height) // 2)
+        page.paste(logo, (x + pad + offset[0], y + pad + offset[1]), logo)
+    else:
+        draw.rectangle((x + pad, y + pad, x + pad + logo_size, y + pad + logo_size), fill=(225, 225, 225))
+
+    # Label and number beside the logo
+    text_x = x + 2 * pad + logo_size
+    text_width = x + width - pad - text_x
+    label_font, number_font = _font(_px(0.17, dpi)), _font(_px(0.14, dpi))
+    draw.text((text_x, y + pad), _fit(draw, card['label'] or "Loyalty card", label_font, text_width),
+              fill="black", font=label_font)
+    draw.text((text_x, y + pad + _px(0.3, dpi)), _fit(draw, card['number'], number_font, text_width),
+              fill=(60, 60, 60), font=number_font)
+
+    # Barcode across the card, with the number printed under it
+    bar_y = y + 2 * pad + logo_size
+    bar_width, bar_height = width - 2 * pad, _px(BARCODE_HEIGHT, dpi)
+    caption_font = _font(_px(0.12, dpi))
+    try:
+        barcode = rasterize_modules(code128_modules(card['number']), (bar_width, bar_height))
+        page.paste(barcode.convert("RGB"), (x + pad, bar_y))
+        caption = card['number']
+    except ValueError:
+        caption = f"{card['number']} (no Code 128 barcode fits)"
+    caption = _fit(draw, caption, caption_font, bar_width)
+    caption_x = x + pad + (bar_width - int(draw.textlength(caption, font=caption_font))) // 2
+    draw.text((caption_x, bar_y + bar_height + inset), caption, fill="black", font=caption_font)
+
+
+def render_page(job):
+    """Render one PageJob (worker process).
+
+    PNG pages are written straight to job.target and (target, bytes) is
+    returned; PDF pages come back as (width, height, Flate-compressed RGB).
+    """
+    from PIL import Image, ImageDraw
+
+    width_in, height_in = PAPER_SIZES[job.paper]
+    page = Image.new("RGB", (_px(width_in, job.dpi), _px(height_in, job.dpi)), "white")
+    draw = ImageDraw.Draw(page)
+
+    margin = _px(MARGIN, job.dpi)
+    cell_width = (page.width - 2 * margin) // COLUMNS
+    cell_height = (page.height - 2 * margin - _px(FOOTER, job.dpi)) // ROWS
+    for slot, card in enumerate(job.cards):
+        box = (margin + (slot % COLUMNS) * cell_width, margin + (slot // COLUMNS) * cell_height,
+               cell_width, cell_height)
+        _draw_card(page, draw, card, box, job.dpi)
+    footer = f"{job.account} - page {job.page} of {job.pages}"
+    draw.text((margin, page.height - margin - _px(FOOTER, job.dpi) // 2), footer,
+              fill=(120, 120, 120), font=_font(_px(0.1, job.dpi)))
+
+    if job.fmt == "png":
+        tmp = f"{job.target}.tmp"
+        page.save(tmp, format="PNG", dpi=(job.dpi, job.dpi), compress_level=PAGE_COMPRESSION)
+        os.replace(tmp, job.target)
+        return job.target, os.path.getsize(job.target)
+    return page.width, page.height, zlib.compress(page.tobytes(), PAGE_COMPRESSION)
+
+
+class PdfWriter:
+    """Streaming multi-page PDF writer, one full-page image per page.
+
+    Pages go to disk as they are added; only the object offsets are kept,
+    so a PDF of any length is written in constant memory. The file appears
+    under its final name on close().
+    """
+
+    def __init__(self, path, paper):
+        self.path = path
+        self.tmp = f"{path}.tmp"
+        self.points = tuple(inches * 72 for inches in PAPER_SIZES[paper])
+        self.offsets = {}
+        self.pages = []
+        self.next_id = 3  # 1 and 2 are the catalog and the page tree, written last
+        self.f = open(self.tmp, "wb")
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _object(self, body, stream=None, obj_id=None):
+        if obj_id is None:
+            obj_id = self.next_id
+            self.next_id += 1
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(f"{obj_id} 0 obj\n".encode("ascii") + body.encode("ascii"))
+        if stream is not None:
+            self.f.write(b"\nstream\n" + stream + b"\nendstream")
+        self.f.write(b"\nendobj\n")
+        return obj_id
+
+    def add_page(self, width, height, data):
+        """Add a page showing a Flate-compressed RGB image of width x height pixels"""
+        image = self._object(f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                             f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+                             f"/Length {len(data)} >>", data)
+        w, h = self.points
+        content = f"q {w:.2f} 0 0 {h:.2f} 0 0 cm /Im0 Do Q".encode("ascii")
+        contents = self._object(f"<< /Length {len(content)} >>", content)
+        self.pages.append(self._object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {w:.2f} {h:.2f}] "
+            f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {contents} 0 R >>"))
+
+    def close(self):
+        kids = " ".join(f"{page} 0 R" for page in self.pages)
+        self._object(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>", obj_id=2)
+        self._object("<< /Type /Catalog /Pages 2 0 R >>", obj_id=1)
+        xref = self.f.tell()
+        self.f.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode("ascii"))
+        for obj_id in range(1, self.next_id):
+            self.f.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode("ascii"))
+        self.f.write(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+        self.f.close()
+        os.replace(self.tmp, self.path)
+
+
+def _rendered(jobs, workers):
+    """Yield (job, render_page result) in job order, a bounded number in flight"""
+    if workers == 1:
+        for job in jobs:
+            yield job, render_page(job)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    window = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append((job, pool.submit(render_page, job)))
+            if len(pending) >= window:
+                job, future = pending.popleft()
+                yield job, future.result()
+        while pending:
+            job, future = pending.popleft()
+            yield job, future.result()
+
+
+def export_sheets(paths, out_dir="sheets", fmt="pdf", paper="a4", dpi=200, workers=None, on_account=None):
+    """Render barcode sheets for every cards.jsonl under paths into out_dir.
+
+    Each account becomes out_dir/<name>.pdf, or out_dir/<name>/page-NNNN.png
+    with fmt="png". on_account(name, pages, target) is called as each
+    account is finished. Returns totals of accounts, pages and cards.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    totals = {"accounts": 0, "pages": 0, "cards": 0}
+    writer = None
+    jobs = iter_page_jobs(find_card_files(paths), out_dir, fmt, paper, dpi)
+    try:
+        for job, result in _rendered(jobs, workers):
+            if fmt == "pdf":
+                if job.page == 1:
+                    writer = PdfWriter(job.target, paper)
+                writer.add_page(*result)
+            totals["pages"] += 1
+            totals["cards"] += len(job.cards)
+            if job.page == job.pages:
+                if writer is not None:
+                    writer.close()
+                    writer = None
+                totals["accounts"] += 1
+                if on_account:
+                    on_account(job.account, job.pages, job.target if fmt == "pdf" else os.path.dirname(job.target))
+    finally:
+        if writer is not None:
+            # Interrupted mid-account: leave no half-written PDF behind
+            writer.f.close()
+            os.remove(writer.tmp)
+    return totals
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="cards.jsonl files or directories to search for them")
+    parser.add_argument("--output", default="sheets", help="directory for the sheets")
+    parser.add_argument("--format", choices=("pdf", "png"), default="pdf",
+                        help="one multi-page PDF per account, or one PNG per page")
+    parser.add_argument("--paper", choices=sorted(PAPER_SIZES), default="a4")
+    parser.add_argument("--dpi", type=int, default=200, help="print resolution of the rendered pages")
+    parser.add_argument("--workers", type=int, default=None, help="rendering processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    def report(name, pages, target):
+        print(f"{name}: {pages} page(s) -> {target}")
+
+    totals = export_sheets(args.paths, args.output, args.format, args.paper, args.dpi, args.workers, report)
+    print(f"\nRendered {totals['cards']} cards from {totals['accounts']} accounts on {totals['pages']} pages.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import mmap
+import os
+import struct
+import time
+from io import BytesIO
+
+SNAPSHOT_NAME = "cards.snapshot"
+MAGIC = b"STOCSNAP"
+FORMAT_VERSION = 2
+THUMBNAIL_SIZE = (100, 100)
+
+FLAG_THUMBNAILS = 1
+FLAG_BARCODES = 2
+
+# magic, version, flags, card count, backup size, backup mtime_ns, backup
+# change counter, user id (offset, length), created, then the offsets of
+# the card table, string pool and blob area
+HEADER = struct.Struct("<8sHHIQQIIIQQQQ")
+# number, label, provider_id, logo_path as (offset, length) into the string
+# pool (logo_path relative to the snapshot's directory), then the logo thumbnail and barcode modules as (offset, length)
+# into the blob area
+RECORD = struct.Struct("<8IQIQI")
+NONE = 0xFFFFFFFF
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def backup_stamp(path):
+    """(size, mtime_ns, SQLite file change counter) of a backup, or zeros"""
+    try:
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            f.seek(24)
+            counter = f.read(4)
+    except OSError:
+        return 0, 0, 0
+    counter = struct.unpack(">I", counter)[0] if len(counter) == 4 else 0
+    return st.st_size, st.st_mtime_ns, counter
+
+
+def _thumbnail(logo_path):
+    from PIL import Image
+
+    try:
+        with Image.open(logo_path) as logo:
+            logo = logo.resize(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        logo.save(buffer, format="PNG")
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"Error making thumbnail of {logo_path}: {e}")
+        return None
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError as e:
+        print(f"Error reading thumbnail {path}: {e}")
+        return None
+
+
+def _relative_path(logo_path, base):
+    """logo_path relative to base, or absolute if that is impossible (another drive)"""
+    if not logo_path:
+        return logo_path
+    try:
+        return os.path.relpath(logo_path, base)
+    except ValueError:
+        return os.path.abspath(logo_path)
+
+
+def write_snapshot(path, user_id, cards, backup=None, images=True, logo_dir=None):
+    """Write cards (dicts with number, label, provider_id, logo_path) to path.
+
+    With images, each distinct logo is stored once as a PNG thumbnail and
+    every card gets its Code 128 module pattern. Thumbnails already made
+    in logo_dir (a LogoStore directory) are copied in as they are; only
+    logos without one are resized here. backup is the sync_db the cards
+    came from; its stamp lets readers tell when the snapshot is stale.
+    """
+    manifest = None
+    if images:
+        from stocard_barcode import code128_modules
+        if logo_dir:
+            from stocard_logos import LogoManifest
+            manifest = LogoManifest(logo_dir)
+    base = os.path.dirname(os.path.abspath(path))
+
+    strings = bytearray()
+    string_offsets = {}
+    blobs = bytearray()
+    thumbnails = {}
+
+    def add_string(text):
+        if text is None:
+            return 0, NONE
+        data = str(text).encode("utf-8")
+        if data not in string_offsets:
+            string_offsets[data] = len(strings)
+            strings.extend(data)
+        return string_offsets[data], len(data)
+
+    def add_blob(data):
+        if not data:
+            return 0, 0
+        blobs.extend(data)
+        return len(blobs) - len(data), len(data)
+
+    records = bytearray()
+    count = 0
+    for card in cards:
+        logo = barcode = (0, 0)
+        if images:
+            logo_path = card.get('logo_path')
+            thumbnail_path = manifest and manifest.thumbnail_path(card.get('provider_id'), THUMBNAIL_SIZE)
+            if thumbnail_path and os.path.exists(thumbnail_path):
+                if thumbnail_path not in thumbnails:
+                    thumbnails[thumbnail_path] = add_blob(_read(thumbnail_path))
+                logo = thumbnails[thumbnail_path]
+            elif logo_path and os.path.exists(logo_path):
+                if logo_path not in thumbnails:
+                    thumbnails[logo_path] = add_blob(_thumbnail(logo_path))
+                logo = thumbnails[logo_path]
+            try:
+                barcode = add_blob(code128_modules(card['number']).encode("ascii"))
+            except ValueError:
+                pass  # Not encodable in Code 128; the viewer shows the number instead
+        fields = []
+        for key in ('number', 'label', 'provider_id'):
+            fields += add_string(card.get(key))
+        fields += add_string(_relative_path(card.get('logo_path'), base))
+        records += RECORD.pack(*fields, *logo, *barcode)
+        count += 1
+
+    user = add_string(user_id)
+    flags = (FLAG_THUMBNAILS | FLAG_BARCODES) if images else 0
+    cards_offset = HEADER.size
+    strings_offset = cards_offset + len(records)
+    blobs_offset = strings_offset + len(strings)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, flags, count, *backup_stamp(backup or ""),
+                         *user, int(time.time()), cards_offset, strings_offset, blobs_offset)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(records)
+        f.write(strings)
+        f.write(blobs)
+    os.replace(tmp, path)
+    return count
+
+
+class CardSnapshot:
+    """Read-only, memory-mapped view of a snapshot written by write_snapshot.
+
+    Opening costs one file open and a header read; cards are decoded on
+    access and image data is only touched when asked for.
+    """
+
+    def __init__(self, path=SNAPSHOT_NAME):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{path} is empty")
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise SnapshotError(f"{path} is too short to be a snapshot")
+
+        (magic, version, self.flags, self.count, size, mtime_ns, counter, user_offset,
+         user_length, self.created, self._cards, self._strings, self._blobs) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise SnapshotError(f"{path} is not a version {FORMAT_VERSION} card snapshot")
+        self.stamp = (size, mtime_ns, counter)
+        self._base = os.path.dirname(path)
+        self.user_id = self._string(user_offset, user_length)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, offset, length):
+        if length == NONE:
+            return None
+        start = self._strings + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    def _record(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return RECORD.unpack_from(self._map, self._cards + index * RECORD.size)
+
+    def __getitem__(self, index):
+        """Card `index` as a dict like the loader's, plus its snapshot_index"""
+        fields = self._record(index)
+        return {
+            'number': self._string(fields[0], fields[1]),
+            'label': self._string(fields[2], fields[3]),
+            'provider_id': self._string(fields[4], fields[5]),
+            'logo_path': self._logo_path(fields[6], fields[7]),
+            'snapshot_index': index,
+        }
+
+    def _logo_path(self, offset, length):
+        logo_path = self._string(offset, length)
+        return os.path.join(self._base, logo_path) if logo_path else logo_path
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def _blob(self, offset, length):
+        if not length:
+            return None
+        start = self._blobs + offset
+        return self._map[start:start + length]
+
+    def logo_image(self, index):
+        """The card's embedded logo thumbnail as a PIL image, or None"""
+        from PIL import Image
+
+        fields = self._record(index)
+        data = self._blob(fields[8], fields[9])
+        if data is None:
+            return None
+        with Image.open(BytesIO(data)) as logo:
+            logo.load()
+            return logo
+
+    def barcode_modules(self, index):
+        """The card's Code 128 module pattern ('1' bar, '0' space), or None"""
+        fields = self._record(index)
+        data = self._blob(fields[10], fields[11])
+        return data.decode("ascii") if data is not None else None
+
+    def barcode_image(self, index, size):
+        """The card's barcode rasterized at size, or None if not embedded"""
+        from stocard_barcode import rasterize_modules
+
+        modules = self.barcode_modules(index)
+        return rasterize_modules(modules, tuple(size)) if modules else None
+
+    def is_stale(self, backup="sync_db"):
+        """True if backup exists and changed since the snapshot was written"""
+        if not os.path.exists(backup):
+            return False
+        return backup_stamp(backup) != self.stamp
+
+
+def open_snapshot(path=None):
+    """Open path (default: SNAPSHOT_NAME if it exists); None if there is none.
+
+    A default snapshot that cannot be read, say one from an older
+    extractor, is reported and skipped so the viewers use sync_db.
+    """
+    if path is not None:
+        return CardSnapshot(path)
+    if not os.path.exists(SNAPSHOT_NAME):
+        return None
+    try:
+        return CardSnapshot(SNAPSHOT_NAME)
+    except SnapshotError as e:
+        print(f"Ignoring {SNAPSHOT_NAME}: {e}; write a new one with the extractor's --snapshot")
+        return None
@@ -1,140 +1,373 @@
-import sqlite3
-import json
 import os
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
-import barcode
-from barcode.writer import ImageWriter
-from io import BytesIO
-import tempfile
+from collections import OrderedDict
+
+from stocard_background import BackgroundLoader
+from stocard_barcode import BarcodeCache
+from stocard_cards import CardStore
+from stocard_logos import LogoManifest
+from stocard_metrics import Metrics, NULL_METRICS
+from stocard_search import CardSearchIndex
+from stocard_snapshot import SNAPSHOT_NAME, open_snapshot
+from stocard_watch import DEFAULT_INTERVAL_MS, BackupWatcher, is_unchanged
+
+# Tabs whose widgets and images stay alive; older ones are rebuilt when revisited
+MAX_LIVE_TABS = 10
 
 class StocardViewerSimple:
-    def __init__(self, root):
+    def __init__(self, root, max_live_tabs=MAX_LIVE_TABS, metrics=None, snapshot=None, watch_ms=None):
         self.root = root
+        self.metrics = metrics or NULL_METRICS
+        self.snapshot = snapshot
         self.root.title("Stocard Card Viewer")
         self.root.geometry("900x700")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Loading progress, shown until every card has arrived
+        self.status_frame = ttk.Frame(root)
+        self.status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 10))
+        self.status_label = ttk.Label(self.status_frame, text="Loading cards...")
+        self.status_label.pack(side=tk.LEFT)
+        self.progress = ttk.Progressbar(self.status_frame, mode="determinate", length=250)
+        self.progress.pack(side=tk.RIGHT)
+        
+        # Search box, hides the tabs of cards that do not match
+        self.search_frame = ttk.Frame(root)
+        self.search_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=(10, 0))
+        ttk.Label(self.search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(self.search_frame, textvariable=self.search_var, width=40)
+        self.search_entry.pack(side=tk.LEFT, padx=(5, 10))
+        self.search_entry.bind("<Escape>", lambda event: self.search_var.set(""))
+        self.search_status = ttk.Label(self.search_frame, text="", foreground="gray")
+        self.search_status.pack(side=tk.LEFT)
+        self.search_var.trace_add("write", lambda *args: self.apply_search())
+        self.root.bind("<Control-f>", lambda event: self.search_entry.focus_set())
         
         # Create notebook for tabs
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        
+        # Tab contents are built on first view, most recently viewed last
+        self.max_live_tabs = max_live_tabs
+        self.tab_frames = []
+        self.live_tabs = OrderedDict()
+        
+        # Tabs of cards that do not match the search are hidden, not destroyed
+        self.search = CardSearchIndex()
+        self.hidden_tabs = set()
+        
+        # Rendered barcodes, kept while they are scrolled back and forth
+        self.barcodes = BarcodeCache()
+        
+        # SQLite and PIL work runs in the background, results arrive via after()
+        self.loader = BackgroundLoader(root, metrics=self.metrics)
+        
+        # Logo paths come from the extractor's index, thumbnails preferred
+        self.logos = LogoManifest("logos")
         
-        # Load cards data
-        self.cards_data = self.load_cards_data()
+        # Watch mode: reload sync_db when it changes and patch only the tabs that differ
+        self.watcher = None
+        if watch_ms:
+            self.watcher = BackupWatcher(root, self.loader, "sync_db", self.prepare_card,
+                                         lambda: self.cards_data, self.on_cards_reloaded,
+                                         on_start=self.on_reload_start, interval_ms=watch_ms)
         
-        # Create tabs for each card
-        self.create_card_tabs()
+        # Load cards data, tabs are added as cards arrive
+        self.cards_data = CardStore()
+        self.empty_label = None
+        self.load_cards_data()
     
-    def parse_json(self, blob):
-        try:
-            return json.loads(blob)
-        except:
-            return None
+    def on_close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        self.loader.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.root.destroy()
     
-    def load_logo(self, logo_path):
-        """Load and resize logo image"""
+    def load_logo(self, logo_path, snapshot_index=None):
+        """Load and resize logo image (worker thread)"""
+        from PIL import Image  # Not at the top: the first import happens on a worker
+        
         try:
+            if snapshot_index is not None:
+                # Thumbnail embedded in the snapshot, already 100x100
+                logo_img = self.snapshot.logo_image(snapshot_index)
+                if logo_img is not None:
+                    return logo_img
             if logo_path and os.path.exists(logo_path):
-                logo_img = Image.open(logo_path)
+                # Decoded here, not by PhotoImage on the Tk thread, and the file closed
+                with Image.open(logo_path) as logo_img:
+                    logo_img.load()
+                if logo_img.size == (100, 100):
+                    return logo_img  # Pre-made thumbnail
                 # Resize logo to reasonable size
-                logo_img = logo_img.resize((100, 100), Image.Resampling.LANCZOS)
-                return ImageTk.PhotoImage(logo_img)
+                return logo_img.resize((100, 100), Image.Resampling.LANCZOS)
         except Exception as e:
             print(f"Error loading logo {logo_path}: {e}")
         return None
     
-    def generate_code128_barcode(self, card_number):
-        """Generate Code 128 barcode image"""
+    def generate_code128_barcode(self, card_number, snapshot_index=None):
+        """Generate Code 128 barcode image (worker thread)"""
         try:
-            # Use Code128 barcode format
-            code128 = barcode.get('code128', str(card_number), writer=ImageWriter())
-            
-            # Generate barcode in memory
-            buffer = BytesIO()
-            code128.write(buffer)
-            buffer.seek(0)
-            
-            # Load and resize the barcode image
-            barcode_img = Image.open(buffer)
-            # Resize to fit nicely in the GUI
-            barcode_img = barcode_img.resize((400, 100), Image.Resampling.LANCZOS)
-            
-            return ImageTk.PhotoImage(barcode_img)
+            if snapshot_index is not None:
+                # Module pattern embedded in the snapshot, only needs rasterizing
+                barcode_img = self.snapshot.barcode_image(snapshot_index, (400, 100))
+                if barcode_img is not None:
+                    return barcode_img
+            # Rendered once, then reused from the in-memory barcode cache
+            return self.barcodes.get(card_number, (400, 100))
         except Exception as e:
             print(f"Error generating Code 128 barcode for {card_number}: {e}")
             return None
     
+    def prepare_images(self, card):
+        with self.metrics.stage("card_images_prepare") as stage:
+            stage.count(rows=1)
+            snapshot_index = card.get('snapshot_index')
+            return (self.load_logo(card['logo_path'], snapshot_index),
+                    self.generate_code128_barcode(card['number'], snapshot_index))
+    
     def load_cards_data(self):
-        """Load all card data from database"""
-        cards_data = []
-        
-        # Connect to database
-        conn = sqlite3.connect("sync_db")
-        cur = conn.cursor()
-        
-        # Find distinct_backend_id
-        cur.execute("""
-            SELECT content FROM synced_resources
-            WHERE content LIKE '%distinct_backend_id%'
-        """)
-        user_data = cur.fetchone()
-        
-        if not user_data:
-            return cards_data
-        
-        content = self.parse_json(user_data[0])
-        distinct_backend_id = content.get("distinct_backend_id")
-        
-        # Get loyalty cards
-        cur.execute(f"""
-            SELECT content FROM synced_resources
-            WHERE collection LIKE '/users/{distinct_backend_id}/loyalty-cards/%'
-            AND deleted = 0
-        """)
-        cards = cur.fetchall()
-        
-        for card_row in cards:
-            card = self.parse_json(card_row[0])
-            if card is None:
+        """Start streaming card data from the snapshot if there is one, else the database"""
+        if self.snapshot is not None:
+            self.loader.load_snapshot(self.snapshot, self.prepare_snapshot_card, self.on_user_loaded,
+                                      self.create_card_tabs, self.on_load_done)
+            return
+        self.loader.load_cards("sync_db", self.prepare_card, self.on_user_loaded,
+                               self.create_card_tabs, self.on_load_done, with_ids=self.watcher is not None)
+    
+    def snapshot_note(self):
+        """Status suffix warning when the snapshot is older than ./sync_db"""
+        if self.snapshot is not None and self.snapshot.is_stale("sync_db"):
+            return " from an out of date snapshot (re-run stocard_extractor.py --snapshot)"
+        return ""
+    
+    def prepare_card(self, card):
+        """Keep only the fields shown (reader thread)"""
+        # Get logo path
+        logo_path = self.logos.display_path(card['provider_id'], (100, 100))
+        
+        return {
+            'number': card['number'],
+            'label': card['label'] or 'Unnamed Card',
+            'provider_id': card['provider_id'],
+            'logo_path': logo_path
+        }
+    
+    def prepare_snapshot_card(self, card):
+        """Snapshot cards already have their logo path (reader thread)"""
+        card['label'] = card['label'] or 'Unnamed Card'
+        return card
+    
+    def on_user_loaded(self, distinct_backend_id, total):
+        self.progress.config(maximum=max(total, 1))
+    
+    def on_load_done(self, error):
+        self.progress.pack_forget()
+        if error:
+            self.status_label.config(text=f"Error loading cards: {error}", foreground="red")
+        else:
+            self.status_label.config(text=f"Loaded {len(self.cards_data)} cards{self.snapshot_note()}")
+        
+        self.update_empty_label()
+        if self.watcher is not None:
+            self.watcher.ready()
+    
+    def update_empty_label(self):
+        """Show an error while there are no cards"""
+        if not self.cards_data and self.empty_label is None:
+            self.empty_label = ttk.Label(self.root, text="No cards found in database!", 
+                                         font=("Arial", 14), foreground="red")
+            self.empty_label.pack(expand=True)
+        elif self.cards_data and self.empty_label is not None:
+            self.empty_label.destroy()
+            self.empty_label = None
+    
+    def on_reload_start(self):
+        # Logos extracted since the last load get picked up too
+        self.logos = LogoManifest("logos")
+        self.status_label.config(text="sync_db changed, reloading...", foreground="")
+    
+    def on_cards_reloaded(self, reload, error):
+        """Patch the tabs with a reloaded card list (Tk thread)"""
+        if error:
+            self.status_label.config(text=f"Error reloading cards: {error}", foreground="red")
+            return
+        diff = reload.diff
+        with self.metrics.stage("reload_apply") as stage:
+            stage.count(rows=len(diff.changed) + len(diff.added) + len(diff.removed))
+            if not is_unchanged(diff):
+                self.patch_card_tabs(reload.cards, diff)
+        self.status_label.config(
+            text=f"Reloaded {len(self.cards_data)} cards: {len(diff.added)} added, "
+                 f"{len(diff.changed)} changed, {len(diff.removed)} removed", foreground="")
+        self.update_empty_label()
+    
+    def patch_card_tabs(self, cards, diff):
+        """Bring the notebook in line with cards, touching only tabs that differ.
+        
+        Tabs of unchanged cards keep their widgets and images, and are only
+        moved or renumbered if cards before them came or went. Changed cards
+        keep their tab but its contents are rebuilt when next viewed.
+        """
+        old_frames = self.tab_frames
+        old_to_new = {old: new for new, old in enumerate(diff.kept) if old is not None}
+        frames = [old_frames[old] if old is not None else None for old in diff.kept]
+        for new, old in diff.changed:
+            old_to_new[old] = new
+            frames[new] = old_frames[old]
+            self.release_tab(old)
+        fresh = set()
+        for new in diff.added:
+            frames[new] = ttk.Frame(self.notebook)
+            fresh.add(frames[new])
+        for old in diff.removed:
+            self.live_tabs.pop(old, None)
+            self.notebook.forget(old_frames[old])
+            old_frames[old].destroy()
+        
+        # Move tabs into the new order; the notebook now holds the survivors in old order
+        removed = set(diff.removed)
+        current = [frame for old, frame in enumerate(old_frames) if old not in removed]
+        for new, frame in enumerate(frames):
+            if new < len(current) and current[new] is frame:
                 continue
-                
-            input_id = card.get("input_id")
-            if not input_id:
+            if frame in fresh:
+                current.insert(new, frame)
+                self.notebook.insert(new if new < len(current) - 1 else "end", frame)
+            else:
+                current.remove(frame)
+                current.insert(new, frame)
+                self.notebook.insert(new, frame)
+        
+        # Renumber only what moved or changed
+        refresh = set(diff.added).union(new for new, old in diff.changed)
+        refresh.update(new for old, new in old_to_new.items() if old != new)
+        for new in refresh:
+            self.notebook.tab(frames[new], text=self.tab_text(new, cards[new]))
+        
+        live_tabs = OrderedDict()
+        for old in self.live_tabs:
+            new = old_to_new.get(old)
+            if new is None:
                 continue
-                
-            provider_ref = card.get("input_provider_reference", {}).get("identifier")
-            label = card.get("label")
+            live_tabs[new] = True
+            if new != old:
+                frames[new].title_label.config(text=f"Card #{new+1}")
+        self.live_tabs = live_tabs
+        
+        # Hidden tabs stay hidden when moved; the search then only fixes what differs
+        self.hidden_tabs = {old_to_new[old] for old in self.hidden_tabs if old in old_to_new}
+        self.tab_frames = frames
+        self.cards_data = cards
+        self.search = CardSearchIndex()
+        for card in cards:
+            self.search.add(card)
+        self.apply_search()
+        
+        # A changed card on screen is rebuilt right away
+        selected = self.notebook.select()
+        if selected:
+            self.show_tab(self.notebook.index(selected))
+    
+    def tab_text(self, i, card):
+        tab_name = f"{card['label'][:15]}..." if len(card['label']) > 15 else card['label']
+        return f"{i+1}. {tab_name}"
+    
+    def create_card_tabs(self, cards):
+        """Create a placeholder tab for each card in a batch"""
+        with self.metrics.stage("card_batch") as stage:
+            stage.count(rows=len(cards))
+            self.add_card_tabs(cards)
+    
+    def add_card_tabs(self, cards):
+        for card in cards:
+            i = self.cards_data.append(card)
             
-            # Get logo path
-            logo_path = None
-            if provider_ref:
-                provider_id = provider_ref.split('/')[-1] if '/' in provider_ref else provider_ref
-                potential_logo = f"logos/{provider_id}.png"
-                if os.path.exists(potential_logo):
-                    logo_path = potential_logo
+            # Create tab, its contents are built when it is first selected
+            tab_frame = ttk.Frame(self.notebook)
+            self.notebook.add(tab_frame, text=self.tab_text(i, card))
+            self.tab_frames.append(tab_frame)
             
-            cards_data.append({
-                'number': str(input_id),
-                'label': label or 'Unnamed Card',
-                'logo_path': logo_path
-            })
-        
-        conn.close()
-        return cards_data
+            self.search.add(card)
+            query = self.search_var.get()
+            if query.strip() and not self.search.matches(i, query):
+                self.notebook.hide(tab_frame)
+                self.hidden_tabs.add(i)
+        
+        self.progress.config(value=len(self.cards_data))
+        self.status_label.config(text=f"Loading cards... {len(self.cards_data)}")
+        self.update_search_status()
+        if self.tab_frames and not self.live_tabs and 0 not in self.hidden_tabs:
+            self.show_tab(0)
     
-    def create_card_tabs(self):
-        """Create a tab for each card"""
-        for i, card in enumerate(self.cards_data):
-            # Create tab
-            tab_frame = ttk.Frame(self.notebook)
-            tab_name = f"{card['label'][:15]}..." if len(card['label']) > 15 else card['label']
-            self.notebook.add(tab_frame, text=f"{i+1}. {tab_name}")
+    def apply_search(self):
+        """Show only the tabs of cards matching the search box"""
+        with self.metrics.stage("search") as stage:
+            matches = self.search.search(self.search_var.get())
+            if matches is None:
+                matches = range(len(self.tab_frames))
+                hide = set()
+            else:
+                hide = set(range(len(self.tab_frames))).difference(matches)
+            stage.count(rows=len(matches))
             
-            # Create card display in tab
-            self.create_card_display(tab_frame, card, i+1)
+            # Only tabs whose state changes are touched
+            for index in sorted(self.hidden_tabs - hide):
+                self.notebook.add(self.tab_frames[index])
+            # Select a match first, so hiding the current tab does not build others.
+            # Tk does not select a tab that is shown again, so after a search
+            # without matches the first match is selected here too
+            selected = self.notebook.select()
+            if matches and (not selected or self.notebook.index(selected) in hide):
+                self.notebook.select(self.tab_frames[matches[0]])
+            for index in hide - self.hidden_tabs:
+                self.notebook.hide(self.tab_frames[index])
+            self.hidden_tabs = hide
+        self.update_search_status()
+    
+    def update_search_status(self):
+        if self.search_var.get().strip():
+            shown = len(self.tab_frames) - len(self.hidden_tabs)
+            self.search_status.config(text=f"{shown} of {len(self.tab_frames)} cards match")
+        else:
+            self.search_status.config(text="")
+    
+    def on_tab_changed(self, event):
+        selected = self.notebook.select()
+        if selected:
+            self.show_tab(self.notebook.index(selected))
+    
+    def show_tab(self, index):
+        """Build a tab's contents if needed and release the least recently viewed"""
+        if index in self.live_tabs:
+            self.live_tabs.move_to_end(index)
+            return
+        
+        self.create_card_display(self.tab_frames[index], self.cards_data[index], index+1)
+        self.live_tabs[index] = True
+        
+        while len(self.live_tabs) > self.max_live_tabs:
+            old_index, _ = self.live_tabs.popitem(last=False)
+            self.release_tab(old_index)
+    
+    def release_tab(self, index):
+        """Destroy a tab's contents, which drops their logo and barcode images"""
+        self.live_tabs.pop(index, None)
+        for child in self.tab_frames[index].winfo_children():
+            child.destroy()
     
     def create_card_display(self, parent, card, card_num):
         """Create the display for a single card"""
+        with self.metrics.stage("card_tab_build") as stage:
+            stage.count(rows=1)
+            self.build_card_display(parent, card, card_num)
+    
+    def build_card_display(self, parent, card, card_num):
         # Main container
         main_frame = ttk.Frame(parent, padding=20)
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -146,6 +379,7 @@ class StocardViewerSimple:
         title_label = ttk.Label(title_frame, text=f"Card #{card_num}", 
                                font=("Arial", 16, "bold"))
         title_label.pack()
+        parent.title_label = title_label  # Renumbered in watch mode
         
         # Card label (if available) - make it prominent
         if card['label'] and card['label'] != 'Unnamed Card':
@@ -168,14 +402,11 @@ class StocardViewerSimple:
             
             ttk.Label(logo_frame, text="Logo:", font=("Arial", 10, "bold")).pack()
             
-            logo_img = self.load_logo(card['logo_path'])
-            if logo_img:
-                logo_label = ttk.Label(logo_frame, image=logo_img)
-                logo_label.image = logo_img  # Keep reference
-                logo_label.pack(pady=5)
-            else:
-                ttk.Label(logo_frame, text="Logo file not found", 
-                         background="lightgray", width=15, anchor="center").pack()
+            # Filled in by show_card_images once the logo is decoded
+            logo_label = ttk.Label(logo_frame, text="Loading...", width=15, anchor="center")
+            logo_label.pack(pady=5)
+        else:
+            logo_label = None
         
         # Card details (right side)
         details_frame = ttk.Frame(top_section)
@@ -208,11 +439,39 @@ class StocardViewerSimple:
         barcode_frame.pack(fill=tk.X, pady=(0, 20))
         
         # Generate and display Code 128 barcode
-        barcode_img = self.generate_code128_barcode(card['number'])
+        barcode_label = ttk.Label(barcode_frame, text="Generating barcode...")
+        barcode_label.pack(pady=5)
+        
+        # Images are decoded in the background and shown when ready
+        self.loader.submit(self.prepare_images, card, callback=lambda images: 
+                           self.show_card_images(card, logo_label, barcode_label, images))
+    
+    def show_card_images(self, card, logo_label, barcode_label, images):
+        """Put a card's prepared images on screen (Tk thread)"""
+        if not barcode_label.winfo_exists():
+            return  # Tab was released before the images were ready
+        with self.metrics.stage("card_images_apply") as stage:
+            stage.count(rows=1)
+            self.apply_card_images(card, logo_label, barcode_label, images)
+    
+    def apply_card_images(self, card, logo_label, barcode_label, images):
+        from PIL import ImageTk
+        
+        logo_img, barcode_img = images or (None, None)
+        
+        if logo_label is not None:
+            if logo_img:
+                logo_img = ImageTk.PhotoImage(logo_img)
+                logo_label.config(image=logo_img, text="", width="")
+                logo_label.image = logo_img  # Keep reference
+            else:
+                logo_label.config(text="Logo file not found", background="lightgray")
+        
+        barcode_frame = barcode_label.master
         if barcode_img:
-            barcode_label = ttk.Label(barcode_frame, image=barcode_img)
+            barcode_img = ImageTk.PhotoImage(barcode_img)
+            barcode_label.config(image=barcode_img, text="")
             barcode_label.image = barcode_img  # Keep reference
-            barcode_label.pack(pady=5)
             
             # Instructions
             instructions = ttk.Label(barcode_frame, 
@@ -221,8 +480,8 @@ class StocardViewerSimple:
             instructions.pack()
         else:
             # Fallback to text representation
-            ttk.Label(barcode_frame, text=f"Could not generate barcode for: {card['number']}", 
-                     foreground="red").pack()
+            barcode_label.config(text=f"Could not generate barcode for: {card['number']}", 
+                                 foreground="red")
             
             # Show card number in large text as fallback
             fallback_text = tk.Text(barcode_frame, height=3, font=("Courier", 12), 
@@ -255,17 +514,23 @@ class StocardViewerSimple:
         # Auto close after 1.5 seconds
         message.after(1500, message.destroy)
 
-def main():
+def main(metrics_path=None, snapshot_path=None, watch_ms=None):
     root = tk.Tk()
-    app = StocardViewerSimple(root)
-    
-    if not app.cards_data:
-        # Show error if no cards found
-        error_label = ttk.Label(root, text="No cards found in database!", 
-                               font=("Arial", 14), foreground="red")
-        error_label.pack(expand=True)
-    
+    metrics = Metrics() if metrics_path else None
+    app = StocardViewerSimple(root, metrics=metrics, snapshot=open_snapshot(snapshot_path), watch_ms=watch_ms)
     root.mainloop()
+    if metrics:
+        metrics.write(metrics_path)
+        print(f"Metrics written to {metrics_path}")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="View the loyalty cards in ./sync_db")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="on exit, write per-stage timings (e.g. per-card widget build) to PATH as JSON")
+    parser.add_argument("--snapshot", default=None, metavar="PATH",
+                        help=f"read cards from this snapshot instead of sync_db (default: ./{SNAPSHOT_NAME} if present)")
+    parser.add_argument("--watch", nargs="?", type=float, const=DEFAULT_INTERVAL_MS / 1000, default=None,
+                        metavar="SECONDS", help="reload sync_db when it changes, checking every SECONDS (default: 1)")
+    args = parser.parse_args()
+    main(args.metrics, args.snapshot, int(args.watch * 1000) if args.watch else None)
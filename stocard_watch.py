@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from stocard_cards import CardStore
+
+# How often the viewers look at sync_db in watch mode
+DEFAULT_INTERVAL_MS = 1000
+
+# Card keys that identify a card rather than describe it
+IDENTITY_FIELDS = ('card_id', 'content_hash', 'snapshot_index')
+
+# Result of comparing a reloaded card list with the one on screen:
+# kept[new] is the old index of an unchanged card at new position `new`, or None;
+# changed lists (new, old) positions of cards whose content differs;
+# added lists the new positions of new cards; removed the old indexes that are gone
+CardDiff = namedtuple("CardDiff", ["kept", "changed", "added", "removed"])
+CardReload = namedtuple("CardReload", ["user_id", "cards", "diff"])
+
+
+def file_stamp(path):
+    """(inode, size, mtime_ns) of path and of its -wal file; None parts when missing"""
+    stamp = []
+    for name in (path, f"{path}-wal"):
+        try:
+            st = os.stat(name)
+            stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def card_hash(card):
+    """Hash of everything a viewer shows of a card"""
+    content = {key: value for key, value in card.items() if key not in IDENTITY_FIELDS}
+    text = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=12).hexdigest()
+
+
+def identify(card, card_id):
+    """Tag a prepared card with its ID and content hash, for diffing later reloads"""
+    card['card_id'] = card_id
+    card['content_hash'] = card_hash(card)
+    return card
+
+
+def _column(cards, key):
+    if isinstance(cards, CardStore):
+        return cards.column(key)
+    return [card.get(key) for card in cards]
+
+
+def diff_cards(old_cards, new_cards):
+    """Match new_cards to old_cards by card ID, then compare content hashes.
+
+    Cards without an ID (read from a snapshot) never match, so the first
+    reload after starting from a snapshot replaces them all.
+    """
+    old_hashes = _column(old_cards, 'content_hash')
+    old_index = {card_id: index for index, card_id in enumerate(_column(old_cards, 'card_id')) if card_id}
+    kept = []
+    changed = []
+    added = []
+    matched = set()
+    new_hashes = _column(new_cards, 'content_hash')
+    for new, card_id in enumerate(_column(new_cards, 'card_id')):
+        old = old_index.get(card_id)
+        if old is None:
+            kept.append(None)
+            added.append(new)
+            continue
+        matched.add(old)
+        if old_hashes[old] == new_hashes[new]:
+            kept.append(old)
+        else:
+            kept.append(None)
+            changed.append((new, old))
+    removed = [index for index in range(len(old_cards)) if index not in matched]
+    return CardDiff(kept, changed, added, removed)
+
+
+def is_unchanged(diff):
+    """True when the reload has the same cards, in the same order"""
+    return not (diff.changed or diff.added or diff.removed) and \
+        all(old == new for new, old in enumerate(diff.kept))
+
+
+class FileWatcher:
+    """Polls a file from the Tk loop and calls on_change once it has changed and settled.
+
+    A change is only reported after the file looked the same on two polls
+    in a row, so a backup that is still being copied in is not read half
+    written. Only os.stat is called per poll.
+    """
+
+    def __init__(self, root, path, on_change, interval_ms=DEFAULT_INTERVAL_MS):
+        self.root = root
+        self.path = path
+        self.on_change = on_change
+        self.interval_ms = interval_ms
+        self.stamp = file_stamp(path)
+        self._settling = None
+        self._poll_id = self.root.after(self.interval_ms, self._poll)
+
+    def _poll(self):
+        stamp = file_stamp(self.path)
+        if stamp == self.stamp or stamp[0] is None:
+            self._settling = None  # Unchanged, or mid-replace with no file yet
+        elif stamp != self._settling:
+            self._settling = stamp
+        else:
+            self.stamp = stamp
+            self._settling = None
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"Error handling change of {self.path}: {e}")
+        self._poll_id = self.root.after(self.interval_ms, self._poll)
+
+    def close(self):
+        try:
+            self.root.after_cancel(self._poll_id)
+        except Exception:
+            pass
+
+
+class BackupWatcher:
+    """Watch mode for the viewers: reload a backup whenever it changes.
+
+    The reload runs on the loader's reader thread and ends with
+    on_reload(reload, error) on the Tk thread, where reload is a
+    CardReload diffed against current_cards(). That must be a card list
+    the viewer replaces rather than changes once loaded, such as a
+    CardStore, as the reader thread reads it. Only one reload runs at a
+    time; changes seen meanwhile cause one more reload afterwards. The
+    initial load counts as a reload in progress until ready() is called.
+    on_start, if given, runs on the Tk thread before each reload.
+    """
+
+    def __init__(self, root, loader, path, prepare_card, current_cards, on_reload,
+                 on_start=None, interval_ms=DEFAULT_INTERVAL_MS):
+        self.loader = loader
+        self.path = path
+        self.prepare_card = prepare_card
+        self.current_cards = current_cards
+        self.on_reload = on_reload
+        self.on_start = on_start
+        self.busy = True
+        self.again = False
+        self.watcher = FileWatcher(root, path, self.changed, interval_ms)
+
+    def ready(self):
+        """The initial load is done; reload now if the file changed meanwhile"""
+        self.busy = False
+        if self.again:
+            self.changed()
+
+    def changed(self):
+        if self.busy:
+            self.again = True
+            return
+        self.busy = True
+        self.again = False
+        if self.on_start:
+            self.on_start()
+        self.loader.reload_cards(self.path, self.prepare_card, self.current_cards(), self.done)
+
+    def done(self, reload, error):
+        try:
+            self.on_reload(reload, error)
+        finally:
+            self.ready()
+
+    def close(self):
+        self.watcher.close()